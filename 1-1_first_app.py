@@ -1,11 +1,12 @@
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
+from model_registry import get_chat_model
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
+from response_cache import enable_response_cache, stream_with_cache
 
 load_dotenv()
 
-llm = ChatOpenAI(model='gpt-3.5-turbo', temperature=0.7)
+llm = get_chat_model(model='gpt-3.5-turbo', temperature=0.7)
 prompt = ChatPromptTemplate.from_messages([
     ('system', 'You are a helpful AI assistant. Provide clear, concise answers.'),
     ('human', '{question}')
@@ -15,12 +16,22 @@ output_parser = StrOutputParser()
 chain = prompt | llm | output_parser
 # Use the application
 def ask_question(question):
-    response = chain.invoke({'question', question})
+    response = chain.invoke({'question': question})
     return response
+
+def stream_answer(question):
+    # Yield the answer token by token so the first words show up immediately;
+    # a cached answer comes back in one piece
+    for chunk in stream_with_cache(llm, prompt.invoke({'question': question}).to_messages()):
+        yield chunk.content
 if __name__ == '__main__':
+    # Serve repeated questions from the local cache
+    enable_response_cache()
     while True:
         user_question = input("\nAsk a question (or 'quit' to exit): ")
         if user_question.lower() == 'quit':
             break
-        answer = ask_question(user_question)
-        print(f'\nAnswer: {answer}')
+        print('\nAnswer: ', end='', flush=True)
+        for token in stream_answer(user_question):
+            print(token, end='', flush=True)
+        print()
@@ -1,29 +1,42 @@
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
+from model_registry import get_chat_model
 from langchain_core.prompts import ChatPromptTemplate
 from langchain.memory import ConversationBufferWindowMemory
 from langchain_core.runnables import RunnablePassthrough
+from langchain_core.messages import AIMessage, HumanMessage
 from langchain_community.callbacks import get_openai_callback
+from response_cache import astream_with_cache, enable_response_cache, stream_with_cache
+from collections import OrderedDict
+import asyncio
+import json
+import sqlite3
+import sys
+import time
 
 load_dotenv()
 
+def create_qa_prompt():
+    return ChatPromptTemplate.from_messages([
+        ('system', """
+            You are a helpful AI assistant. Use the conversation history to provide contextual responses.
+            If you don't know omething, say so clearly.
+        """),
+        ('placeholder', '{chat_history}'),
+        ('human', '{question}')
+    ])
+
 class IntelligentQA:
     def __init__(self):
-        self.llm = ChatOpenAI(model='gpt-3.5-turbo', temperature=0.7)
+        # stream_usage makes streamed responses report token counts for cost tracking
+        self.llm = get_chat_model(model='gpt-3.5-turbo', temperature=0.7, stream_usage=True)
         self.memory = ConversationBufferWindowMemory(k=5, return_messages=True)
-        self.prompt = ChatPromptTemplate.from_messages([
-            ('system', """
-                You are a helpful AI assistant. Use the conversation history to provide contextual responses.
-                If you don't know omething, say so clearly.
-            """),
-            ('placeholder', '{chat_history}'),
-            ('human', '{question}')
-        ])
-        self.chain = (
+        self.prompt = create_qa_prompt()
+        self.prompt_chain = (
             RunnablePassthrough.assign(chat_history=lambda x: self.memory.chat_memory.messages)
             | self.prompt
-            | self.llm
         )
+        self.chain = self.prompt_chain | self.llm
+        self.last_stream_stats = None
 
     def ask(self, question):
         try:
@@ -38,10 +51,187 @@ class IntelligentQA:
             print(f"Error: {e}")
             return "Sorry, I couldn't process your request due to an error."   
 
+    def ask_stream(self, question):
+        # Yield answer tokens as they arrive; memory and cost are only updated
+        # once the stream has finished so a failed stream leaves history untouched.
+        # Streaming bypasses the LLM cache, so stream_with_cache checks and fills it
+        start = time.perf_counter()
+        first_token_at = None
+        chunks = []
+        try:
+            with get_openai_callback() as cb:
+                messages = self.prompt_chain.invoke({'question': question}).to_messages()
+                for chunk in stream_with_cache(self.llm, messages):
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    chunks.append(chunk.content)
+                    yield chunk.content
+        except Exception as e:
+            print(f"Error: {e}")
+            yield "Sorry, I couldn't process your request due to an error."
+            return
+        self._finish_stream(question, chunks, cb, start, first_token_at)
+
+    async def aask_stream(self, question):
+        # Async counterpart of ask_stream built on astream
+        start = time.perf_counter()
+        first_token_at = None
+        chunks = []
+        try:
+            with get_openai_callback() as cb:
+                messages = (await self.prompt_chain.ainvoke({'question': question})).to_messages()
+                async for chunk in astream_with_cache(self.llm, messages):
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    chunks.append(chunk.content)
+                    yield chunk.content
+        except Exception as e:
+            print(f"Error: {e}")
+            yield "Sorry, I couldn't process your request due to an error."
+            return
+        self._finish_stream(question, chunks, cb, start, first_token_at)
+
+    def _finish_stream(self, question, chunks, cb, start, first_token_at):
+        self.memory.chat_memory.add_user_message(question)
+        self.memory.chat_memory.add_ai_message(''.join(chunks))
+        self.last_stream_stats = {
+            'time_to_first_token': (first_token_at or time.perf_counter()) - start,
+            'total_time': time.perf_counter() - start,
+            'prompt_tokens': cb.prompt_tokens,
+            'completion_tokens': cb.completion_tokens,
+            'total_cost': cb.total_cost,
+        }
+
     def clear_history(self):
         self.memory.clear()
-    
-if __name__ == '__main__':
+
+class QASession:
+    # Compact per-session state: the last window of (role, content) tuples.
+    # in_use counts turns holding the session, including ones waiting for its lock
+    __slots__ = ('history', 'lock', 'last_active', 'in_use')
+
+    def __init__(self, history=None):
+        self.history = history or []
+        self.lock = asyncio.Lock()
+        self.last_active = time.monotonic()
+        self.in_use = 0
+
+class QASessionManager:
+    # Hosts many concurrent conversations in one process. The chain is stateless
+    # and shared; each session only keeps its message window. Idle sessions beyond
+    # max_active_sessions are evicted least-recently-used to a SQLite file and
+    # transparently reloaded on their next question.
+    def __init__(self, llm=None, window: int = 5, max_active_sessions: int = 10000,
+                 max_concurrent_requests: int = 256, spill_path: str = '.qa_sessions.sqlite'):
+        self.llm = llm or get_chat_model(model='gpt-3.5-turbo', temperature=0.7)
+        self.chain = create_qa_prompt() | self.llm
+        self.window = window
+        self.max_active_sessions = max_active_sessions
+        self.max_concurrent_requests = max_concurrent_requests
+        self.sessions = OrderedDict()
+        self.stats = {'requests': 0, 'evictions': 0, 'reloads': 0}
+        self._request_slots = None
+        self._conn = sqlite3.connect(spill_path)
+        self._conn.execute('CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, history TEXT)')
+        self._conn.commit()
+
+    def _get_session(self, session_id: str) -> QASession:
+        # Returns the session pinned for one turn; the caller releases it with in_use -= 1
+        session = self.sessions.get(session_id)
+        if session is not None:
+            self.sessions.move_to_end(session_id)
+            session.in_use += 1
+            return session
+        row = self._conn.execute(
+            'SELECT history FROM sessions WHERE session_id = ?', (session_id,)
+        ).fetchone()
+        if row is not None:
+            self._conn.execute('DELETE FROM sessions WHERE session_id = ?', (session_id,))
+            self.stats['reloads'] += 1
+            session = QASession([tuple(message) for message in json.loads(row[0])])
+        else:
+            session = QASession()
+        self.sessions[session_id] = session
+        session.in_use += 1
+        self._evict_idle()
+        return session
+
+    def _evict_idle(self):
+        overflow = len(self.sessions) - self.max_active_sessions
+        if overflow <= 0:
+            return
+        evicted = []
+        for session_id, session in self.sessions.items():
+            if len(evicted) >= overflow:
+                break
+            # Sessions with a turn in flight or waiting stay resident
+            if not session.in_use and session.history:
+                evicted.append((session_id, json.dumps(session.history)))
+        self._conn.executemany('INSERT OR REPLACE INTO sessions VALUES (?, ?)', evicted)
+        self._conn.commit()
+        for session_id, _ in evicted:
+            del self.sessions[session_id]
+        self.stats['evictions'] += len(evicted)
+
+    async def ask(self, session_id: str, question: str) -> str:
+        if self._request_slots is None:
+            self._request_slots = asyncio.Semaphore(self.max_concurrent_requests)
+        session = self._get_session(session_id)
+        try:
+            # Turns within one conversation are serialized; different sessions run concurrently
+            async with session.lock:
+                chat_history = [
+                    HumanMessage(content=content) if role == 'human' else AIMessage(content=content)
+                    for role, content in session.history
+                ]
+                async with self._request_slots:
+                    response = await self.chain.ainvoke({'question': question, 'chat_history': chat_history})
+                session.history.append(('human', question))
+                session.history.append(('ai', response.content))
+                del session.history[:-2 * self.window]
+                session.last_active = time.monotonic()
+        finally:
+            session.in_use -= 1
+        self.stats['requests'] += 1
+        return response.content
+
+    def clear_session(self, session_id: str):
+        self.sessions.pop(session_id, None)
+        self._conn.execute('DELETE FROM sessions WHERE session_id = ?', (session_id,))
+        self._conn.commit()
+
+async def run_load_test(sessions: int = 5000, turns: int = 4, concurrent_users: int = 1000,
+                        llm_delay: float = 0.05, max_active_sessions: int = 2000):
+    # Drive many concurrent conversations through a fake LLM to measure the
+    # manager's own overhead; run one such process per core to scale out.
+    # Caching is off so every turn reaches the model
+    from fake_models import FakeChatModel
+    llm = FakeChatModel(response='This is a simulated answer.', delay=llm_delay, cache=False)
+    manager = QASessionManager(llm=llm, max_active_sessions=max_active_sessions, spill_path=':memory:')
+    latencies = []
+    users = asyncio.Semaphore(concurrent_users)
+    async def conversation(session_id):
+        async with users:
+            for turn in range(turns):
+                start = time.perf_counter()
+                await manager.ask(session_id, f'Question {turn} from {session_id}')
+                latencies.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    await asyncio.gather(*(conversation(f'session-{i}') for i in range(sessions)))
+    # Every tenth user comes back later, so early sessions are reloaded from disk
+    await asyncio.gather(*(manager.ask(f'session-{i}', 'One more question') for i in range(0, sessions, 10)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    print(f'{sessions} sessions x {turns} turns in {elapsed:.2f}s '
+          f"({manager.stats['requests'] / elapsed:.0f} requests/s)")
+    print(f'p50 {latencies[len(latencies) // 2] * 1000:.1f}ms, '
+          f'p95 {latencies[int(len(latencies) * 0.95)] * 1000:.1f}ms')
+    print(manager.stats)
+
+if __name__ == '__main__' and sys.argv[1:] == ['load-test']:
+    asyncio.run(run_load_test())
+elif __name__ == '__main__':
+    enable_response_cache()
     qa_app = IntelligentQA()
     print('Intelligent Q&A Assistant')
     print("Type 'clear' to reset conversation, 'quit' to exit\n")
@@ -53,5 +243,11 @@ if __name__ == '__main__':
             qa_app.clear_history()
             print('Conversation history cleared\n')
             continue
-        answer = qa_app.ask(question)
-        print(f'Assistant: {answer}]\n')
+        print('Assistant: ', end='', flush=True)
+        for token in qa_app.ask_stream(question):
+            print(token, end='', flush=True)
+        stats = qa_app.last_stream_stats
+        if stats:
+            print(f"\n(first token {stats['time_to_first_token']:.2f}s, total {stats['total_time']:.2f}s, "
+                  f"{stats['prompt_tokens'] + stats['completion_tokens']} tokens, ${stats['total_cost']:.4f})")
+        print()
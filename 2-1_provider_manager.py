@@ -1,32 +1,294 @@
-from langchain_openai import ChatOpenAI, OpenAI
-from langchain_anthropic import ChatAnthropic
+from langchain_openai import OpenAI
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import HumanMessage
+from collections import deque
+from enum import Enum
 import asyncio
+import time
 from dotenv import load_dotenv
+from fake_models import FakeChatModel
+from model_registry import get_chat_model
+from response_cache import SemanticResponseCache
 
 load_dotenv()
 
+class ProviderStats:
+    # Rolling latency and error-rate statistics over the last window_size calls.
+    # Outcomes older than max_age seconds no longer count, so a provider demoted for
+    # errors gets a clean slate (and traffic again) once its failures age out
+    def __init__(self, window_size: int = 100, max_age: float = 60.0, clock=time.monotonic):
+        self.latencies = deque(maxlen=window_size)
+        # (timestamp, succeeded) pairs
+        self.outcomes = deque(maxlen=window_size)
+        self.max_age = max_age
+        self.clock = clock
+
+    def record_success(self, latency: float):
+        self.latencies.append(latency)
+        self.outcomes.append((self.clock(), True))
+
+    def record_failure(self):
+        self.outcomes.append((self.clock(), False))
+
+    def record_cancelled(self, elapsed: float):
+        # A call cancelled after elapsed seconds (e.g. a hedge loser) would have taken at
+        # least that long; keeping it as a censored sample stops p95 from only seeing winners
+        self.latencies.append(elapsed)
+
+    def _recent_outcomes(self) -> list:
+        cutoff = self.clock() - self.max_age
+        while self.outcomes and self.outcomes[0][0] < cutoff:
+            self.outcomes.popleft()
+        return [succeeded for _, succeeded in self.outcomes]
+
+    def percentile(self, pct: float):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    @property
+    def p50(self):
+        return self.percentile(50)
+
+    @property
+    def p95(self):
+        return self.percentile(95)
+
+    @property
+    def samples(self) -> int:
+        return len(self._recent_outcomes())
+
+    @property
+    def error_rate(self) -> float:
+        outcomes = self._recent_outcomes()
+        if not outcomes:
+            return 0.0
+        return outcomes.count(False) / len(outcomes)
+
+    def snapshot(self) -> dict:
+        return {
+            'p50': self.p50,
+            'p95': self.p95,
+            'error_rate': self.error_rate,
+            'samples': self.samples,
+        }
+
+class BreakerState(str, Enum):
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+class CircuitBreaker:
+    # Trips open after failure_threshold consecutive failures, rejects calls for
+    # cooldown seconds, then lets half_open_max_calls probe requests through
+    def __init__(self, failure_threshold: int = 3, cooldown: float = 30.0,
+                 half_open_max_calls: int = 1, success_threshold: int = 1, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.half_open_max_calls = half_open_max_calls
+        self.success_threshold = success_threshold
+        self.clock = clock
+        self._state = BreakerState.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probes_in_flight = 0
+        self.probe_successes = 0
+        # Lifetime counters for metrics export
+        self.total_successes = 0
+        self.total_failures = 0
+        self.rejected = 0
+        self.times_opened = 0
+
+    @property
+    def state(self) -> BreakerState:
+        if self._state == BreakerState.OPEN and self.clock() - self.opened_at >= self.cooldown:
+            self._state = BreakerState.HALF_OPEN
+            self.probes_in_flight = 0
+            self.probe_successes = 0
+        return self._state
+
+    def is_available(self) -> bool:
+        # Peek without reserving a probe slot
+        state = self.state
+        if state == BreakerState.HALF_OPEN:
+            return self.probes_in_flight < self.half_open_max_calls
+        return state == BreakerState.CLOSED
+
+    def allow_request(self) -> bool:
+        state = self.state
+        if state == BreakerState.CLOSED:
+            return True
+        if state == BreakerState.HALF_OPEN and self.probes_in_flight < self.half_open_max_calls:
+            self.probes_in_flight += 1
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self):
+        self.total_successes += 1
+        self.consecutive_failures = 0
+        if self._state == BreakerState.HALF_OPEN:
+            self.probes_in_flight = max(0, self.probes_in_flight - 1)
+            self.probe_successes += 1
+            if self.probe_successes >= self.success_threshold:
+                self._state = BreakerState.CLOSED
+
+    def record_failure(self):
+        self.total_failures += 1
+        self.consecutive_failures += 1
+        if self._state == BreakerState.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self._trip()
+
+    def release(self):
+        # A probe that was cancelled before it finished frees its slot
+        if self._state == BreakerState.HALF_OPEN:
+            self.probes_in_flight = max(0, self.probes_in_flight - 1)
+
+    def _trip(self):
+        self._state = BreakerState.OPEN
+        self.opened_at = self.clock()
+        self.times_opened += 1
+
+    def snapshot(self) -> dict:
+        return {
+            'state': self.state.value,
+            'consecutive_failures': self.consecutive_failures,
+            'total_successes': self.total_successes,
+            'total_failures': self.total_failures,
+            'rejected': self.rejected,
+            'times_opened': self.times_opened,
+        }
+
+class TokenBucket:
+    # Continuously refilling bucket holding only burst_seconds of quota, so a fresh
+    # or idle limiter can't spend a whole minute's allowance in the first few seconds
+    def __init__(self, per_minute: float, burst_seconds: float = 1.0, clock=time.monotonic):
+        self.refill_rate = per_minute / 60.0
+        self.capacity = max(1.0, self.refill_rate * burst_seconds)
+        self.tokens = self.capacity
+        self.clock = clock
+        self.updated_at = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_rate)
+        self.updated_at = now
+
+    def time_until(self, amount: float) -> float:
+        self._refill()
+        # Requests larger than the whole bucket wait for a full bucket instead of forever
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.tokens) / self.refill_rate)
+
+    def consume(self, amount: float):
+        # Oversized requests are charged in full; the debt delays the calls after them
+        self._refill()
+        self.tokens -= amount
+
+class RateLimiter:
+    # Async limiter enforcing requests-per-minute and tokens-per-minute together,
+    # plus a cap on in-flight calls. headroom keeps usage just under the quota.
+    def __init__(self, rpm: float = None, tpm: float = None, max_concurrency: int = None,
+                 headroom: float = 0.9):
+        self.request_bucket = TokenBucket(rpm * headroom) if rpm else None
+        self.token_bucket = TokenBucket(tpm * headroom) if tpm else None
+        self.max_concurrency = max_concurrency
+        self._lock = None
+        self._semaphore = None
+
+    async def acquire(self, tokens: int = 0) -> float:
+        # Wait until both buckets can cover the call; returns seconds spent queued
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+            self._semaphore = asyncio.Semaphore(self.max_concurrency) if self.max_concurrency else None
+        start = time.perf_counter()
+        if self._semaphore is not None:
+            await self._semaphore.acquire()
+        try:
+            # The lock keeps waiters FIFO so large requests are not starved
+            async with self._lock:
+                while True:
+                    wait = 0.0
+                    if self.request_bucket is not None:
+                        wait = max(wait, self.request_bucket.time_until(1))
+                    if self.token_bucket is not None:
+                        wait = max(wait, self.token_bucket.time_until(tokens))
+                    if wait <= 0:
+                        break
+                    await asyncio.sleep(wait)
+                if self.request_bucket is not None:
+                    self.request_bucket.consume(1)
+                if self.token_bucket is not None:
+                    self.token_bucket.consume(tokens)
+        except asyncio.CancelledError:
+            # A waiter cancelled in the queue gives its in-flight slot back
+            self.release()
+            raise
+        return time.perf_counter() - start
+
+    def release(self):
+        if self._semaphore is not None:
+            self._semaphore.release()
+
+def estimate_tokens(prompt: str, model) -> int:
+    # Rough quota estimate: ~4 characters per input token plus the completion budget
+    return len(prompt) // 4 + 1 + (getattr(model, 'max_tokens', None) or 0)
+
 class ProviderManager:
-    def __init__(self):
-        self.providers = {
-            'openai_fast': ChatOpenAI(
-                model='gpt-3.5-turbo',
+    def __init__(self, providers: dict = None, stats_window: int = 100,
+                 default_hedge_delay: float = 2.0, max_error_rate: float = 0.5,
+                 min_error_samples: int = 5, stats_max_age: float = 60.0,
+                 failure_threshold: int = 3, breaker_cooldown: float = 30.0,
+                 half_open_max_calls: int = 1, rate_limits: dict = None,
+                 response_cache: SemanticResponseCache = None):
+        if providers is not None:
+            self.providers = providers
+        else:
+            self.providers = self._default_providers(response_cache)
+        self.stats = {name: ProviderStats(stats_window, stats_max_age) for name in self.providers}
+        # Hedge delay used until a provider has latency samples of its own
+        self.default_hedge_delay = default_hedge_delay
+        # Providers failing more often than this, over at least min_error_samples recent
+        # calls, are ranked behind healthy ones
+        self.max_error_rate = max_error_rate
+        self.min_error_samples = min_error_samples
+        self.breakers = {
+            name: CircuitBreaker(failure_threshold, breaker_cooldown, half_open_max_calls)
+            for name in self.providers
+        }
+        # Optional per-provider quotas, e.g. {'openai_fast': {'rpm': 3500, 'tpm': 90000}}
+        rate_limits = rate_limits or {}
+        self.limiters = {
+            name: RateLimiter(**rate_limits[name]) if name in rate_limits else None
+            for name in self.providers
+        }
+
+    def _default_providers(self, response_cache=None):
+        # A cache of None falls back to the global LLM cache, if one is set. Models come
+        # from the shared registry, so both OpenAI entries use one connection pool
+        return {
+            'openai_fast': get_chat_model(
+                'openai', 'gpt-3.5-turbo',
                 temperature=0.1,
                 max_tokens=1000,
                 request_timeout=30,
                 max_retries=3,
+                cache=response_cache,
             ),
-            'openai_quality': ChatOpenAI(
-                model='gpt-4',
+            'openai_quality': get_chat_model(
+                'openai', 'gpt-4',
                 temperature=0.2,
                 max_tokens=2000,
                 request_timeout=60,
+                cache=response_cache,
             ),
-            'anthropic': ChatAnthropic(
-                model='claude-3-sonnet-20240229',
+            'anthropic': get_chat_model(
+                'anthropic', 'claude-3-sonnet-20240229',
                 temperature=0.1,
                 max_tokens=1500,
+                cache=response_cache,
             )
         }
 
@@ -34,44 +296,203 @@ class ProviderManager:
         # Run inference across multiple providers simultaneously
         if providers is None:
             providers = list(self.providers.keys())
-        async def get_response(name, model):
-            try:
-                response = await model.ainvoke([HumanMessage(content=prompt)])
-                return name, response.content, None
-            except Exception as e:
-                return name, None, str(e)
         # Execute requests in parallel
         tasks = [
-            get_response(name, self.providers[name])
+            self._limited_response(name, prompt)
             for name in providers
-            if name in self.providers
+            if self._known(name)
         ]
         results = await asyncio.gather(*tasks)
-        return {name: {'response': response, 'error': error} for name, response, error in results}
+        return dict(results)
+
+    async def parallel_inference_many(self, prompts: list, providers: list = None,
+                                      max_concurrency: int = 32):
+        # Batch version of parallel_inference. Each provider drains its own queue of
+        # the prompts with its own bounded worker pool, paced by its RateLimiter, so a
+        # provider held back by a tight quota doesn't slow the others down
+        if providers is None:
+            providers = list(self.providers.keys())
+        providers = [name for name in providers if self._known(name)]
+        per_provider = {name: [None] * len(prompts) for name in providers}
+        async def drain(name):
+            queue = asyncio.Queue()
+            for index, prompt in enumerate(prompts):
+                queue.put_nowait((index, prompt))
+            async def worker():
+                while not queue.empty():
+                    index, prompt = queue.get_nowait()
+                    _, per_provider[name][index] = await self._limited_response(name, prompt)
+            await asyncio.gather(*(worker() for _ in range(min(max_concurrency, len(prompts)))))
+        await asyncio.gather(*(drain(name) for name in providers))
+        return [{name: per_provider[name][index] for name in providers} for index in range(len(prompts))]
+
+    async def _limited_response(self, name: str, prompt: str):
+        model = self.providers[name]
+        limiter = self.limiters[name]
+        breaker = self.breakers[name]
+        result = {'response': None, 'error': None, 'queue_wait': 0.0, 'latency': None}
+        # Open circuits are rejected before queueing, so they don't spend quota
+        if not breaker.allow_request():
+            result['error'] = 'Circuit open'
+            return name, result
+        if limiter is not None:
+            try:
+                result['queue_wait'] = await limiter.acquire(estimate_tokens(prompt, model))
+            except asyncio.CancelledError:
+                breaker.release()
+                raise
+        try:
+            # The circuit may have opened while this call was queued
+            if breaker.state == BreakerState.OPEN:
+                result['error'] = 'Circuit open'
+                return name, result
+            start = time.perf_counter()
+            try:
+                response = await model.ainvoke([HumanMessage(content=prompt)])
+            except asyncio.CancelledError:
+                breaker.release()
+                raise
+            except Exception as e:
+                breaker.record_failure()
+                result['error'] = str(e)
+                return name, result
+            finally:
+                result['latency'] = time.perf_counter() - start
+            breaker.record_success()
+            result['response'] = response.content
+            return name, result
+        finally:
+            if limiter is not None:
+                limiter.release()
+
+    def _known(self, name: str) -> bool:
+        return name in self.providers and name in self.breakers
 
     def failover_inference(self, prompt: str, provider_order: list = None):
         # Try providers in order until one succeeds
         if provider_order is None:
             provider_order = ['openai_fast', 'anthropic', 'openai_quality']
         for provider_name in provider_order:
+            if not self._known(provider_name):
+                continue
+            # Known-down providers are skipped without a network call
+            breaker = self.breakers[provider_name]
+            if not breaker.allow_request():
+                continue
             try:
                 model = self.providers[provider_name]
                 response = model.invoke([HumanMessage(content=prompt)])
-                return {
-                    'response': response.content,
-                    'provider': provider_name,
-                    'error': None
-                }
             except Exception as e:
+                breaker.record_failure()
                 continue
+            breaker.record_success()
+            return {
+                'response': response.content,
+                'provider': provider_name,
+                'error': None
+            }
         return {
             'response': None,
             'provider': None,
             'error': 'All providers failed',
         }
 
+    def rank_providers(self, providers: list = None) -> list:
+        # Order providers fastest-healthy first: error rate gate, then observed p50
+        if providers is None:
+            providers = list(self.providers.keys())
+        def sort_key(name):
+            stats = self.stats[name]
+            unhealthy = stats.samples >= self.min_error_samples and stats.error_rate > self.max_error_rate
+            # Providers without samples sort first so they get measured
+            return (unhealthy, stats.p50 if stats.p50 is not None else 0.0)
+        available = (
+            name for name in providers
+            if self._known(name) and self.breakers[name].is_available()
+        )
+        return sorted(available, key=sort_key)
+
+    def hedge_delay(self, provider_name: str) -> float:
+        p95 = self.stats[provider_name].p95
+        return p95 if p95 is not None else self.default_hedge_delay
+
+    async def _timed_invoke(self, provider_name: str, messages: list):
+        if not self._known(provider_name):
+            raise ValueError(f'Unknown provider: {provider_name}')
+        breaker = self.breakers[provider_name]
+        if not breaker.allow_request():
+            raise RuntimeError(f'Circuit open for {provider_name}')
+        start = time.perf_counter()
+        try:
+            response = await self.providers[provider_name].ainvoke(messages)
+        except asyncio.CancelledError:
+            self.stats[provider_name].record_cancelled(time.perf_counter() - start)
+            breaker.release()
+            raise
+        except Exception:
+            self.stats[provider_name].record_failure()
+            breaker.record_failure()
+            raise
+        self.stats[provider_name].record_success(time.perf_counter() - start)
+        breaker.record_success()
+        return response
+
+    async def routed_inference(self, prompt: str, providers: list = None, hedge: bool = True):
+        # Send to the fastest healthy provider; if it hasn't answered by its p95,
+        # hedge with the runner-up and keep whichever answers first
+        candidates = self.rank_providers(providers)
+        messages = [HumanMessage(content=prompt)]
+        start = time.perf_counter()
+        pending = {}
+        errors = {}
+        hedged = False
+        def launch_next():
+            name = candidates.pop(0)
+            pending[asyncio.create_task(self._timed_invoke(name, messages))] = name
+        try:
+            while candidates or pending:
+                if not pending:
+                    launch_next()
+                # Only one hedge per request: a second in-flight call, never a fan-out
+                can_hedge = hedge and not hedged and candidates and len(pending) == 1
+                timeout = self.hedge_delay(next(iter(pending.values()))) if can_hedge else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    launch_next()
+                    continue
+                for task in done:
+                    name = pending.pop(task)
+                    if task.exception() is None:
+                        return {
+                            'response': task.result().content,
+                            'provider': name,
+                            'error': None,
+                            'latency': time.perf_counter() - start,
+                            'hedged': hedged,
+                        }
+                    errors[name] = str(task.exception())
+        finally:
+            # Cancel whichever call lost the race
+            for task in pending:
+                task.cancel()
+        return {
+            'response': None,
+            'provider': None,
+            'error': f'All providers failed: {errors}',
+            'latency': time.perf_counter() - start,
+            'hedged': hedged,
+        }
+
+    def provider_stats(self) -> dict:
+        return {name: stats.snapshot() for name, stats in self.stats.items()}
+
+    def breaker_states(self) -> dict:
+        # Per-provider circuit state and counters, suitable for metrics export
+        return {name: breaker.snapshot() for name, breaker in self.breakers.items()}
+
 async def demo_provider_management():
-    manager = ProviderManager()
+    manager = ProviderManager(response_cache=SemanticResponseCache())
     # Parallel comparison
     results = await manager.parallel_inference('Explain quantum computing in simple terms')
     for provider, result in results.items():
@@ -80,5 +501,50 @@ async def demo_provider_management():
     result = manager.failover_inference('What is machine learning?')
     print(f'Response from {result['provider']}: {result['response'] if result['response'] else result['error']}')
 
+async def demo_adaptive_routing(requests: int = 200):
+    # Offline comparison of fixed-primary vs. latency-aware hedged routing
+    def fake_providers():
+        return {
+            'fast_but_spiky': FakeChatModel(response='spiky', delay=0.02, tail_delay=1.0, tail_rate=0.05),
+            'steady': FakeChatModel(response='steady', delay=0.05),
+            'flaky': FakeChatModel(response='flaky', delay=0.01, failure_rate=0.6),
+        }
+    for hedge in (False, True):
+        manager = ProviderManager(providers=fake_providers())
+        latencies = []
+        for _ in range(requests):
+            result = await manager.routed_inference('What is machine learning?', hedge=hedge)
+            latencies.append(result['latency'])
+        latencies.sort()
+        p50 = latencies[len(latencies) // 2]
+        p99 = latencies[int(len(latencies) * 0.99) - 1]
+        print(f"hedge={hedge}: p50={p50 * 1000:.1f}ms p99={p99 * 1000:.1f}ms")
+        print(manager.provider_stats())
+        print(manager.breaker_states())
+
+async def demo_rate_limited_batch(prompt_count: int = 60):
+    # Offline batch run against fake providers with small per-minute quotas
+    manager = ProviderManager(
+        providers={
+            'fast': FakeChatModel(response='fast', delay=0.02),
+            'slow': FakeChatModel(response='slow', delay=0.1),
+        },
+        rate_limits={
+            'fast': {'rpm': 600, 'tpm': 60000, 'max_concurrency': 8},
+            'slow': {'rpm': 1200, 'max_concurrency': 4},
+        },
+    )
+    start = time.perf_counter()
+    results = await manager.parallel_inference_many([f'Question {i}' for i in range(prompt_count)])
+    elapsed = time.perf_counter() - start
+    for name in manager.providers:
+        waits = [result[name]['queue_wait'] for result in results]
+        latencies = [result[name]['latency'] for result in results]
+        print(f"{name}: avg queue wait {sum(waits) / len(waits) * 1000:.1f}ms, "
+              f"avg model latency {sum(latencies) / len(latencies) * 1000:.1f}ms")
+    print(f'{prompt_count} prompts in {elapsed:.2f}s')
+
 if __name__ == '__main__':
+    asyncio.run(demo_adaptive_routing())
+    asyncio.run(demo_rate_limited_batch())
     asyncio.run(demo_provider_management())
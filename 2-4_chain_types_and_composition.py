@@ -2,15 +2,23 @@ from langchain_core.runnables import (
     RunnablePassthrough,
     RunnableParallel,
     RunnableLambda,
+    RunnableSequence,
 )
+from langchain_core.runnables.passthrough import RunnableAssign
 from langchain_core.prompts import(
     ChatPromptTemplate,
 )
 from langchain_core.output_parsers import StrOutputParser, JsonOutputParser
-from langchain_openai import ChatOpenAI
+from langchain_core.utils.json import parse_json_markdown
+from model_registry import get_chat_model
+import asyncio
+import json
+import sys
+import time
 
-# Sequential chain
-def create_sequential_analysis_chain():
+# Sequential chain. All steps share one client (and so one HTTP connection pool)
+def create_sequential_analysis_chain(llm=None):
+    llm = llm or get_chat_model()
     # Step 1: Extract key information
     extraction_prompt = ChatPromptTemplate.from_template(
         'Extract key facts from this text: {text}'
@@ -27,34 +35,203 @@ def create_sequential_analysis_chain():
     chain = (
         {'text': RunnablePassthrough()}
         | RunnablePassthrough.assign(
-            facts=extraction_prompt | ChatOpenAI() | StrOutputParser()
+            facts=extraction_prompt | llm | StrOutputParser()
         )
         | RunnablePassthrough.assign(
-            sentiment=sentiment_prompt | ChatOpenAI() | StrOutputParser()
+            sentiment=sentiment_prompt | llm | StrOutputParser()
         )
-        | summary_prompt | ChatOpenAI() | StrOutputParser()
+        | summary_prompt | llm | StrOutputParser()
     )
     return chain
 
-# Parallel chain - multiple operations on same input
-def create_parallel_analysis_chain():
-    return RunnableParallel({
-        'summary': (
-            ChatPromptTemplate.from_template('Summarize: {text}')
-            | ChatOpenAI() | StrOutputParser()
-        ),
-        'sentiment': (
-            ChatPromptTemplate.from_template('Analyze sentiment: {text}')
-            | ChatOpenAI() | StrOutputParser()
-        ),
-        'keywords': (
-            ChatPromptTemplate.from_template('Extract keywords: {text}')
-            | ChatOpenAI() | StrOutputParser()
-        ),
-        'category': (
-            ChatPromptTemplate.from_template('Categorize this text: {text}')
-            | ChatOpenAI() | StrOutputParser()
+def _input_keys(runnable):
+    # Keys a step reads, from its input schema (e.g. a prompt's variables);
+    # None when the step doesn't declare them, such as a RunnableLambda
+    properties = runnable.get_input_jsonschema().get('properties')
+    return set(properties) if properties else None
+
+class ChainPlanner:
+    # Builds a chain from named steps that each read keys of a shared dict and add
+    # their output under their name. Dependencies come from each step's input
+    # schema; steps whose inputs are all available run together in one
+    # RunnablePassthrough.assign level, so a chain costs its critical path instead
+    # of the sum of its steps. Steps with undeclared inputs wait for every earlier step.
+    def __init__(self, steps: dict, inputs=('text',), output=None, head=None):
+        self.steps = steps
+        self.inputs = set(inputs) if inputs is not None else None
+        self.output = output
+        self.head = head
+        self.dependencies = {}
+        self.levels = []
+        self.timings = {}
+        self.last_report = {}
+        self._plan()
+
+    def _plan(self):
+        level_of = {}
+        for name, step in self.steps.items():
+            keys = _input_keys(step)
+            earlier = [other for other in self.steps if other in level_of]
+            if keys is None:
+                dependencies = set(earlier)
+            else:
+                dependencies = keys & set(earlier)
+                unknown = keys - dependencies - (self.inputs or keys)
+                if unknown:
+                    raise ValueError(f'Step {name} reads {sorted(unknown)}, which no input or earlier step provides')
+            self.dependencies[name] = dependencies
+            level_of[name] = 1 + max((level_of[dep] for dep in dependencies), default=-1)
+        self.levels = [
+            [name for name in self.steps if level_of[name] == level]
+            for level in range(max(level_of.values(), default=-1) + 1)
+        ]
+
+    @classmethod
+    def from_sequence(cls, chain: RunnableSequence) -> 'ChainPlanner':
+        # Re-plans an existing head | assign(...) | ... | tail sequence
+        head, steps, tail = [], {}, []
+        for step in chain.steps:
+            if isinstance(step, RunnableAssign) and not tail:
+                steps.update(step.mapper.steps__)
+            elif steps:
+                tail.append(step)
+            else:
+                head.append(step)
+        inputs = None
+        if len(head) == 1 and isinstance(head[0], RunnableParallel):
+            inputs = head[0].steps__.keys()
+        output = RunnableSequence(*tail) if len(tail) > 1 else (tail[0] if tail else None)
+        return cls(steps, inputs, output, RunnableSequence(*head) if len(head) > 1 else (head[0] if head else None))
+
+    def _timed(self, name, step):
+        def on_end(run):
+            self.timings[name] = (run.end_time - run.start_time).total_seconds()
+        return step.with_listeners(on_end=on_end)
+
+    def build(self):
+        chain = self.head
+        for level in self.levels:
+            layer = RunnablePassthrough.assign(**{name: self._timed(name, self.steps[name]) for name in level})
+            chain = layer if chain is None else chain | layer
+        if self.output is not None:
+            output = self._timed('output', self.output)
+            chain = output if chain is None else chain | output
+        return chain
+
+    def report(self, wall_time: float = None) -> dict:
+        # Critical path from the last run's step timings vs. running every step serially;
+        # the output step runs after all others
+        finish = {}
+        for name in self.steps:
+            finish[name] = self.timings.get(name, 0.0) + max((finish[dep] for dep in self.dependencies[name]), default=0.0)
+        output_time = self.timings.get('output', 0.0)
+        self.last_report = {
+            'levels': self.levels,
+            'critical_path': max(finish.values(), default=0.0) + output_time,
+            'summed': sum(self.timings.get(name, 0.0) for name in self.steps) + output_time,
+        }
+        if wall_time is not None:
+            self.last_report['wall_time'] = wall_time
+        return self.last_report
+
+def create_planned_analysis_chain(llm=None):
+    # A wider analysis pipeline expressed as named steps; the planner runs facts,
+    # keywords and category together, then sentiment and risks, then the summary
+    llm = llm or get_chat_model()
+    def step(template):
+        return ChatPromptTemplate.from_template(template) | llm | StrOutputParser()
+    planner = ChainPlanner({
+        'facts': step('Extract key facts from this text: {text}'),
+        'keywords': step('Extract keywords: {text}'),
+        'category': step('Categorize this text: {text}'),
+        'sentiment': step('Analyze sentiment of these facts: {facts}'),
+        'risks': step('List risks implied by these facts: {facts}'),
+    }, output=step(
+        'Create executive summary based on facts: {facts}, sentiment: {sentiment}, '
+        'risks: {risks}, keywords: {keywords} and category: {category}'
+    ))
+    return planner, {'text': RunnablePassthrough()} | planner.build()
+
+class FusedBranches:
+    # Runs sibling prompt | llm branches that read the same input as one request: the
+    # tasks are listed together, the shared input is sent once, and the model answers
+    # with a JSON object holding every field. Fields missing from an unparseable or
+    # incomplete answer fall back to their own per-branch calls.
+    def __init__(self, prompts: dict, llm):
+        self.prompts = prompts
+        self.llm = llm
+        self.branches = {name: prompt | llm | StrOutputParser() for name, prompt in prompts.items()}
+        self.chain = self._fused_prompt() | llm | StrOutputParser()
+        self.stats = {'fused_calls': 0, 'fallback_calls': 0}
+
+    def _fused_prompt(self):
+        variables = sorted({variable for prompt in self.prompts.values() for variable in prompt.input_variables})
+        placeholders = {variable: f'<{variable}>' for variable in variables}
+        tasks = '\n'.join(
+            f'- {name}: ' + ' '.join(str(message.content) for message in prompt.format_messages(**placeholders))
+            for name, prompt in self.prompts.items()
         )
+        template = (
+            'Complete every task below. Reply with only a JSON object whose keys are '
+            f'{", ".join(self.prompts)} and whose values are the answers to each task as strings.\n\n'
+            f'Tasks:\n{tasks}'
+        ).replace('{', '{{').replace('}', '}}')
+        inputs = '\n\n'.join(f'<{variable}>\n{{{variable}}}\n</{variable}>' for variable in variables)
+        return ChatPromptTemplate.from_template(f'{template}\n\n{inputs}')
+
+    def _parse(self, text: str) -> dict:
+        # Strict parsing: a truncated reply is treated as missing every field, so a
+        # cut-off value falls back to its own call instead of being kept
+        try:
+            data = parse_json_markdown(text, parser=json.loads)
+        except ValueError:
+            return {}
+        if not isinstance(data, dict):
+            return {}
+        return {
+            name: value if isinstance(value, str) else json.dumps(value)
+            for name, value in data.items() if name in self.prompts and value is not None
+        }
+
+    def _fallback(self, missing: list):
+        self.stats['fallback_calls'] += len(missing)
+        return RunnableParallel({name: self.branches[name] for name in missing})
+
+    def _run(self, inputs: dict, config) -> dict:
+        self.stats['fused_calls'] += 1
+        results = self._parse(self.chain.invoke(inputs, config))
+        missing = [name for name in self.prompts if name not in results]
+        if missing:
+            results.update(self._fallback(missing).invoke(inputs, config))
+        return {name: results[name] for name in self.prompts}
+
+    async def _arun(self, inputs: dict, config) -> dict:
+        self.stats['fused_calls'] += 1
+        results = self._parse(await self.chain.ainvoke(inputs, config))
+        missing = [name for name in self.prompts if name not in results]
+        if missing:
+            results.update(await self._fallback(missing).ainvoke(inputs, config))
+        return {name: results[name] for name in self.prompts}
+
+    def build(self):
+        return RunnableLambda(self._run, afunc=self._arun)
+
+PARALLEL_ANALYSIS_PROMPTS = {
+    'summary': ChatPromptTemplate.from_template('Summarize: {text}'),
+    'sentiment': ChatPromptTemplate.from_template('Analyze sentiment: {text}'),
+    'keywords': ChatPromptTemplate.from_template('Extract keywords: {text}'),
+    'category': ChatPromptTemplate.from_template('Categorize this text: {text}'),
+}
+
+# Parallel chain - multiple operations on same input. Branches get the same registry
+# model, so they share one connection pool instead of opening a client each.
+# fused=True sends all four tasks as one request, paying for the text once
+def create_parallel_analysis_chain(fused: bool = False, llm=None):
+    llm = llm or get_chat_model()
+    if fused:
+        return FusedBranches(PARALLEL_ANALYSIS_PROMPTS, llm).build()
+    return RunnableParallel({
+        name: prompt | llm | StrOutputParser() for name, prompt in PARALLEL_ANALYSIS_PROMPTS.items()
     })
 
 # Router chain - conditional logic
@@ -75,7 +252,67 @@ def create_router_chain():
             )
     router_chain = (
         RunnableLambda(route_by_type)
-        | ChatOpenAI()
+        | get_chat_model()
         | StrOutputParser()
     )
     return router_chain
+
+def demo_chain_planner():
+    # Every model call takes 200 ms; caching is off so each run pays for its calls
+    from fake_models import FakeChatModel
+    llm = FakeChatModel(response='ok', delay=0.2, cache=False)
+    text = 'Revenue grew 12% while support tickets doubled after the migration.'
+
+    planner = ChainPlanner.from_sequence(create_sequential_analysis_chain(llm))
+    chain = planner.build()
+    start = time.perf_counter()
+    chain.invoke(text)
+    print(f'sequential analysis: {planner.report(time.perf_counter() - start)}')
+
+    planner, chain = create_planned_analysis_chain(llm)
+    serial = {'text': RunnablePassthrough()}
+    for name in planner.steps:
+        serial = serial | RunnablePassthrough.assign(**{name: planner.steps[name]})
+    serial = serial | planner.output
+    start = time.perf_counter()
+    serial.invoke(text)
+    print(f'wider pipeline, one step at a time: {time.perf_counter() - start:.2f}s')
+    start = time.perf_counter()
+    asyncio.run(chain.ainvoke(text))
+    print(f'wider pipeline, planned: {planner.report(time.perf_counter() - start)}')
+
+def benchmark_fused_branches(words: int = 3000):
+    # Fan-out vs. fused execution of the parallel analysis chain on a long document.
+    # The fake model answers fused prompts with JSON (every field, so 4x the output
+    # tokens) and branch prompts with plain text; output costs 10 ms per token
+    from fake_models import FakeChatModel
+    answer = ' '.join(['insight'] * 40)
+
+    class TaskModel(FakeChatModel):
+        malformed: bool = False
+
+        def _respond(self, messages):
+            text = super()._respond(messages)
+            if 'Reply with only a JSON object' not in str(messages[-1].content):
+                return text
+            reply = json.dumps({name: text for name in PARALLEL_ANALYSIS_PROMPTS})
+            # A truncated reply that drops the last fields
+            return reply[:len(reply) // 2] if self.malformed else reply
+
+    document = ' '.join(f'word{i % 500}' for i in range(words))
+    for name, fused, malformed in (('fan-out', False, False), ('fused', True, False),
+                                   ('fused, truncated reply', True, True)):
+        llm = TaskModel(response=answer, delay=0.3, token_delay=0.01, cache=False, malformed=malformed)
+        branches = FusedBranches(PARALLEL_ANALYSIS_PROMPTS, llm) if fused else None
+        chain = branches.build() if fused else create_parallel_analysis_chain(llm=llm)
+        start = time.perf_counter()
+        result = chain.invoke({'text': document})
+        elapsed = time.perf_counter() - start
+        print(f'{name:>22}: {llm.calls} requests, {llm.input_tokens} input tokens, {elapsed:.2f}s, '
+              f'fields {sorted(result)}' + (f', {branches.stats}' if branches else ''))
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'fused':
+        benchmark_fused_branches()
+    else:
+        demo_chain_planner()
@@ -6,69 +6,220 @@ from langchain_core.prompts import(
     ChatPromptTemplate,
 )
 from langchain_core.output_parsers import StrOutputParser
-from langchain_openai import ChatOpenAI
+from langchain_core.utils.json import parse_json_markdown
+from model_registry import get_chat_model
 from dotenv import load_dotenv
+from response_cache import enable_response_cache
+import asyncio
+import importlib
+import json
+import re
+import sys
+import time
+
+composition = importlib.import_module('2-4_chain_types_and_composition')
 
 load_dotenv()
 
+def parse_scores(text: str, count: int) -> list:
+    # (score, feedback) for each of `count` candidates from an evaluator reply: a JSON
+    # list of {"score", "feedback"} objects, or "7/10" / "Score: 7" ratings in order.
+    # Candidates without a readable score get 0. JSON is parsed strictly so a truncated
+    # reply falls back to the rating scan instead of keeping a cut-off score
+    try:
+        data = parse_json_markdown(text, parser=json.loads)
+    except ValueError:
+        data = None
+    if isinstance(data, dict):
+        data = data.get('scores', [data])
+    scores = []
+    if isinstance(data, list):
+        for item in data[:count]:
+            item = item if isinstance(item, dict) else {'score': item}
+            try:
+                score = float(item.get('score'))
+            except (TypeError, ValueError):
+                score = 0.0
+            scores.append((score, str(item.get('feedback') or '')))
+    else:
+        matches = list(re.finditer(r'(10|\d(?:\.\d+)?)\s*/\s*10', text)) or list(re.finditer(r'(?i)score\W*(10|\d(?:\.\d+)?)', text))
+        if matches and '{' in text and matches[-1].end() == len(text.rstrip()):
+            # Unparseable JSON ending in a number was cut off mid-score
+            matches.pop()
+        scores = [(float(match.group(1)), '') for match in matches[:count]]
+    scores += [(0.0, '')] * (count - len(scores))
+    return [(min(max(score, 0.0), 10.0), feedback) for score, feedback in scores]
+
+class RefinementEngine:
+    # Each round drafts `candidates` responses concurrently (from the question first, then
+    # by improving the best response so far with its feedback) and scores them all in one
+    # evaluator call. Stops when the best score reaches `threshold`, improves by less than
+    # `min_improvement`, or the next round would overrun `max_tokens` or `time_budget`.
+    # Every round, the first included, is cut off at the time budget, and with max_tokens
+    # the drafts are capped (and fewer if need be) so the first round fits the budget
+    def __init__(self, llm, candidates: int = 3, max_rounds: int = 3, threshold: float = 9.0,
+                 min_improvement: float = 0.5, max_tokens: int = None, time_budget: float = None,
+                 min_draft_tokens: int = 64):
+        self.llm = llm
+        self.candidates = candidates
+        self.max_rounds = max_rounds
+        self.threshold = threshold
+        self.min_improvement = min_improvement
+        self.max_tokens = max_tokens
+        self.time_budget = time_budget
+        self.min_draft_tokens = min_draft_tokens
+        self.last_run = {}
+        # Drafts are numbered so each asks for a distinct approach. That gives them distinct
+        # exact-match cache keys, but a semantic cache tier can still match them to each other
+        self.initial_prompt = ChatPromptTemplate.from_template(
+            'Provide initial response to: {question}\n'
+            '(Draft {draft} of {drafts}: take a distinct approach.)'
+        )
+        self.refine_prompt = ChatPromptTemplate.from_template(
+            'Improve this response based on criteria: {criteria}\n'
+            'Current response: {current_response}\n'
+            'Original question: {question}\n'
+            '(Draft {draft} of {drafts}: take a distinct approach.)'
+        )
+        self.evaluate_prompt = ChatPromptTemplate.from_template(
+            'Rate each candidate response from 1 to 10 and suggest one improvement for each.\n'
+            'Reply with only a JSON list of objects with "score" and "feedback" keys, in candidate order.\n'
+            'Question: {question}\n\n{candidates}'
+        )
+
+    def _tokens(self, prompt_value, message) -> int:
+        # Provider-reported usage when available, otherwise the model's own estimate
+        usage = getattr(message, 'usage_metadata', None)
+        if usage:
+            return usage['total_tokens']
+        return self.llm.get_num_tokens(prompt_value.to_string()) + self.llm.get_num_tokens(str(message.content))
+
+    def _plan(self, question: str) -> tuple:
+        # (drafts per round, completion cap per draft) so the first round fits max_tokens:
+        # n drafts of prompt + cap, then one evaluation reading all n and writing ~50
+        # tokens for each. One draft of min_draft_tokens always runs, so there is an answer
+        if self.max_tokens is None:
+            return self.candidates, None
+        prompt_tokens = self.llm.get_num_tokens(
+            self.initial_prompt.format(question=question, draft=1, drafts=self.candidates)
+        )
+        model_cap = getattr(self.llm, 'max_tokens', None) or float('inf')
+        for count in range(self.candidates, 0, -1):
+            cap = (self.max_tokens - (count + 1) * prompt_tokens - 50 * count) // (2 * count)
+            if cap >= self.min_draft_tokens:
+                return count, int(min(cap, model_cap))
+        return 1, self.min_draft_tokens
+
+    async def _call(self, llm, prompt_values: list, run: dict, finished: list = None) -> list:
+        # Replies are also appended to finished as they land, so a round cut off by the
+        # time budget still has whatever completed
+        async def call(prompt_value):
+            message = await llm.ainvoke(prompt_value)
+            run['calls'] += 1
+            run['tokens'] += self._tokens(prompt_value, message)
+            if finished is not None:
+                finished.append(str(message.content))
+            return str(message.content)
+        return list(await asyncio.gather(*(call(prompt_value) for prompt_value in prompt_values)))
+
+    async def _round(self, question: str, best: dict, run: dict, count: int, cap: int, finished: list) -> list:
+        if best is None:
+            prompts = [
+                self.initial_prompt.format_prompt(question=question, draft=i + 1, drafts=count)
+                for i in range(count)
+            ]
+        else:
+            prompts = [
+                self.refine_prompt.format_prompt(
+                    question=question, current_response=best['response'], draft=i + 1, drafts=count,
+                    criteria=best['feedback'] or 'make it more complete and specific',
+                )
+                for i in range(count)
+            ]
+        drafter = self.llm.bind(max_tokens=cap) if cap is not None else self.llm
+        drafts = await self._call(drafter, prompts, run, finished)
+        listing = '\n\n'.join(f'Candidate {i + 1}:\n{draft}' for i, draft in enumerate(drafts))
+        evaluation, = await self._call(self.llm, [self.evaluate_prompt.format_prompt(question=question, candidates=listing)], run)
+        return [
+            {'response': draft, 'score': score, 'feedback': feedback}
+            for draft, (score, feedback) in zip(drafts, parse_scores(evaluation, len(drafts)))
+        ]
+
+    async def arefine(self, question: str) -> dict:
+        start = time.perf_counter()
+        run = {'calls': 0, 'tokens': 0, 'rounds': 0, 'stopped': 'max_rounds'}
+        count, cap = self._plan(question)
+        best, remaining = None, self.time_budget
+        for _ in range(self.max_rounds):
+            round_start, tokens_before = time.perf_counter(), run['tokens']
+            finished = []
+            try:
+                scored = await asyncio.wait_for(self._round(question, best, run, count, cap, finished), remaining)
+            except asyncio.TimeoutError:
+                run['stopped'] = 'time_budget'
+                if best is None and finished:
+                    # Out of time before the first evaluation: return a draft unscored
+                    best = {'response': finished[0], 'score': None, 'feedback': ''}
+                break
+            run['rounds'] += 1
+            previous = best
+            best = max(scored + ([best] if best else []), key=lambda candidate: candidate['score'])
+            if best['score'] >= self.threshold:
+                run['stopped'] = 'threshold'
+                break
+            if previous is not None and best['score'] - previous['score'] < self.min_improvement:
+                run['stopped'] = 'plateau'
+                break
+            # Assume the next round costs as much as this one
+            if self.max_tokens is not None and 2 * run['tokens'] - tokens_before > self.max_tokens:
+                run['stopped'] = 'token_budget'
+                break
+            if self.time_budget is not None:
+                now = time.perf_counter()
+                remaining = self.time_budget - (now - start)
+                if now - round_start > remaining:
+                    run['stopped'] = 'time_budget'
+                    break
+        # With no draft back inside the time budget, response and score are None
+        best = best or {'response': None, 'score': None}
+        run.update(response=best['response'], score=best['score'], elapsed=time.perf_counter() - start)
+        self.last_run = run
+        return run
+
+    def refine(self, question: str) -> dict:
+        return asyncio.run(self.arefine(question))
+
 class AdvancedChainBuilder:
-    def __init__(self):
-        self.llm = ChatOpenAI(model='gpt-3.5-turbo')
+    def __init__(self, llm=None):
+        self.llm = llm or get_chat_model(model='gpt-3.5-turbo')
     
-    def create_feedback_loop_chain(self, max_iterations: int = 3):
-        def refine_response(state):
-            iteration = state.get('iteration', 0)
-            if iteration >= max_iterations:
-                return state['current_response']
-            if iteration == 0:
-                prompt = ChatPromptTemplate.from_template(
-                    'Provide initial response to: {question}'
-                )
-                response = (prompt | self.llm | StrOutputParser()).invoke(state)
-            else:
-                prompt = ChatPromptTemplate.from_template(
-                    'Improve this response based on crtiteria: {criteria}\n'
-                    'Current response: {current_response}\n'
-                    'Original question: {question}'
-                )
-                response = (prompt | self.llm | StrOutputParser()).invoke(state)
-            # Evaluate response quality
-            eval_prompt = ChatPromptTemplate.from_template(
-                'Rate this response quality (1-10) and suggest improvement\n'
-                'Question: {question}\nResponse: {response}'
-            )
-            evaluation = (eval_prompt | self.llm | StrOutputParser()).invoke({
-                'question': state['question'],
-                'response': response,
-            })
-            # Check if refinement needed
-            if '10' in evaluation or iteration >= max_iterations - 1:
-                return response
-            else:
-                return refine_response({
-                    **state,
-                    'current_response': response,
-                    'criteria': evaluation,
-                    'iteration': iteration + 1
-                })
-        return RunnableLambda(refine_response)
-
-    def create_multi_perspective_chain(self):
+    def create_feedback_loop_chain(self, max_iterations: int = 3, candidates: int = 3, threshold: float = 9.0,
+                                   max_tokens: int = None, time_budget: float = None):
+        # Each chain keeps its own engine, so chains from one builder don't share settings
+        engine = RefinementEngine(self.llm, candidates, max_iterations, threshold,
+                                  max_tokens=max_tokens, time_budget=time_budget)
+
+        async def refine(state):
+            return (await engine.arefine(state['question']))['response']
+        return RunnableLambda(lambda state: engine.refine(state['question'])['response'], afunc=refine)
+
+    def create_multi_perspective_chain(self, fused: bool = False):
         perspectives = {
             'analytical': 'Analyze this from a logical, data-driven perspective: {topic}',
             'creative': 'Explor this topic creatively and imaginatively: {topic}',
             'practical': 'Provide practical, actionable insights on: {topic}',
             'critical': 'Critically examine potential issues with: {topic}',
         }
-        # Generate all perspectives in parallel
-        perspective_chain = RunnableParallel({
-            name: (
-                ChatPromptTemplate.from_template(template)
-                | self.llm
-                | StrOutputParser()
-            )
-            for name, template in perspectives.items()
-        })
+        prompts = {name: ChatPromptTemplate.from_template(template) for name, template in perspectives.items()}
+        if fused:
+            # One request for all perspectives, so the topic is sent once
+            perspective_chain = composition.FusedBranches(prompts, self.llm).build()
+        else:
+            # Generate all perspectives in parallel
+            perspective_chain = RunnableParallel({
+                name: prompt | self.llm | StrOutputParser()
+                for name, prompt in prompts.items()
+            })
         # Synthesize perspectives
         synthesis_prompt = ChatPromptTemplate.from_template(
             """Synthesize these different perspectives into a comprehensive analysis:
@@ -87,7 +238,58 @@ class AdvancedChainBuilder:
         )
         return full_chain
 
+def benchmark_refinement(questions: int = 20):
+    # Refinement on a fake model whose drafts carry a hidden quality: first drafts land
+    # at 3-6, each improvement adds 0-3, and the evaluator reports it. Every call takes
+    # 200 ms. The serial setting drafts once per round and never stops early, like a
+    # fixed-iteration loop
+    from fake_models import FakeChatModel
+    import random
+    import statistics
+    from collections import Counter
+
+    class DraftModel(FakeChatModel):
+        def _respond(self, messages):
+            super()._respond(messages)
+            content = str(messages[-1].content)
+            if content.startswith('Rate each candidate'):
+                return json.dumps([{'score': int(quality), 'feedback': 'add a concrete example'}
+                                   for quality in re.findall(r'quality (\d+)', content)])
+            current = re.search(r'quality (\d+)', content)
+            quality = min(10, int(current.group(1)) + random.randint(0, 3)) if current else random.randint(3, 6)
+            return f'draft of quality {quality}: ' + ' '.join(['detail'] * 60)
+
+    settings = {
+        'serial, no early stop': dict(candidates=1, max_rounds=6, threshold=11, min_improvement=float('-inf')),
+        '1 draft, early stop': dict(candidates=1, max_rounds=6),
+        '3 drafts, early stop': dict(candidates=3, max_rounds=6),
+        '3 drafts, 1s budget': dict(candidates=3, max_rounds=6, time_budget=1.0),
+        '3 drafts, 0.3s budget': dict(candidates=3, max_rounds=6, time_budget=0.3),
+        '3 drafts, 2500 tokens': dict(candidates=3, max_rounds=6, max_tokens=2500),
+        '3 drafts, 600 tokens': dict(candidates=3, max_rounds=6, max_tokens=600),
+    }
+    for name, options in settings.items():
+        random.seed(0)
+        engine = RefinementEngine(DraftModel(delay=0.2, cache=False), **options)
+
+        async def run_all():
+            return await asyncio.gather(*(engine.arefine(f'Question {i}') for i in range(questions)))
+        runs = asyncio.run(run_all())
+        latencies = sorted(run['elapsed'] for run in runs)
+        # Runs cut off before their first evaluation return an unscored draft
+        scores = [run['score'] for run in runs if run['score'] is not None]
+        score = f'{statistics.mean(scores):.1f}' if scores else 'n/a'
+        print(f'{name:>22}: score {score}, '
+              f'{statistics.mean(run["calls"] for run in runs):.1f} calls, '
+              f'{statistics.mean(run["tokens"] for run in runs):.0f} tokens, '
+              f'p50 {statistics.median(latencies):.2f}s, max {latencies[-1]:.2f}s, '
+              f'stopped {dict(Counter(run["stopped"] for run in runs))}')
+
 if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'refine':
+        benchmark_refinement()
+        sys.exit()
+    enable_response_cache()
     builder = AdvancedChainBuilder()
     # Feedback loop for iterative improvement
     feedback_chain = builder.create_feedback_loop_chain(max_iterations=2)
@@ -15,7 +15,7 @@ from langchain_core.runnables import (
 from pydantic import BaseModel, Field, field_validator
 from typing import List, Optional
 from enum import Enum
-from langchain_openai import ChatOpenAI
+from model_registry import get_chat_model
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -40,7 +40,7 @@ class AnalysisResult(BaseModel):
 
 class StructuredOutputProcessor:
     def __init__(self):
-        self.llm = ChatOpenAI(model='gpt-3.5-turbo', temperature=0)
+        self.llm = get_chat_model(model='gpt-3.5-turbo', temperature=0)
         # Different parser types
         # We are using pydantic_parser
         # self.json_parser = JsonOutputParser()
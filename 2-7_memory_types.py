@@ -5,20 +5,257 @@ from langchain.memory import (
     ConversationSummaryBufferMemory,
     VectorStoreRetrieverMemory,
 )
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain.memory.chat_memory import BaseChatMemory
+from langchain.memory.prompt import SUMMARY_PROMPT
+from langchain.storage import LocalFileStore
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
+from langchain_core.stores import InMemoryByteStore
+from langchain_core.language_models import BaseLanguageModel
+from langchain_core.messages import SystemMessage, get_buffer_string
 from langchain_openai import OpenAIEmbeddings
-from langchain_openai import ChatOpenAI
-from typing import List
+from model_registry import get_chat_model
+from pydantic import PrivateAttr
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
 from dotenv import load_dotenv
+import csv
+import json
+import os
+import random
+import sys
+import tracemalloc
+import time
+import faiss
+import numpy as np
 
 load_dotenv()
 
+class TokenBudgetMemory(BaseChatMemory):
+    # Summary-plus-window memory maintained incrementally. Each message is counted
+    # once when it arrives, the window is trimmed by popping cached counts, and only
+    # the messages that overflowed the budget are folded into the running summary.
+    # Trimming goes down to prune_ratio of the budget so a summary call is amortized
+    # over several turns instead of firing on every one.
+    llm: BaseLanguageModel
+    max_token_limit: int = 1000
+    prune_ratio: float = 0.75
+    memory_key: str = 'history'
+    human_prefix: str = 'Human'
+    ai_prefix: str = 'AI'
+    moving_summary: str = ''
+    # Optional message -> token count function; defaults to the llm's tokenizer
+    token_counter: Optional[Callable] = None
+    llm_calls: int = 0
+    _token_counts: deque = PrivateAttr(default_factory=deque)
+    _window_start: int = PrivateAttr(default=0)
+    _window_tokens: int = PrivateAttr(default=0)
+    _processed: int = PrivateAttr(default=0)
+
+    @property
+    def memory_variables(self) -> List[str]:
+        return [self.memory_key]
+
+    def _count_tokens(self, message) -> int:
+        if self.token_counter is not None:
+            return self.token_counter(message)
+        return self.llm.get_num_tokens_from_messages([message])
+
+    def _sync(self):
+        messages = self.chat_memory.messages
+        if len(messages) < self._processed:
+            # History was cleared or replaced underneath us
+            self._reset()
+        for message in messages[self._processed:]:
+            count = self._count_tokens(message)
+            self._token_counts.append(count)
+            self._window_tokens += count
+        self._processed = len(messages)
+        if self._window_tokens <= self.max_token_limit:
+            return
+        target = int(self.max_token_limit * self.prune_ratio)
+        overflow_start = self._window_start
+        while self._token_counts and self._window_tokens > target:
+            self._window_tokens -= self._token_counts.popleft()
+            self._window_start += 1
+        self._fold_into_summary(messages[overflow_start:self._window_start])
+
+    def _fold_into_summary(self, overflow):
+        prompt = SUMMARY_PROMPT.format(
+            summary=self.moving_summary,
+            new_lines=get_buffer_string(overflow, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix),
+        )
+        self.moving_summary = self.llm.invoke(prompt).content
+        self.llm_calls += 1
+
+    def _reset(self):
+        self._token_counts = deque()
+        self._window_start = 0
+        self._window_tokens = 0
+        self._processed = 0
+        self.moving_summary = ''
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        self._sync()
+        buffer = self.chat_memory.messages[self._window_start:]
+        if self.moving_summary:
+            buffer = [SystemMessage(content=self.moving_summary)] + buffer
+        if self.return_messages:
+            return {self.memory_key: buffer}
+        return {self.memory_key: get_buffer_string(buffer, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix)}
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        super().save_context(inputs, outputs)
+        self._sync()
+
+    def clear(self) -> None:
+        super().clear()
+        self._reset()
+
+class BatchedVectorMemory(VectorStoreRetrieverMemory):
+    # Buffers saved turns and adds them to the vector store in micro-batches, so
+    # store writes scale with batch count instead of turn count. A batch is
+    # flushed once it holds batch_size turns or its oldest turn is flush_interval
+    # seconds old. Reads rank turns still pending against the query together with
+    # the stored ones and return the top k, so they never force an early flush;
+    # pending turns are embedded once, on first read or at flush.
+    batch_size: int = 32
+    flush_interval: float = 1.0
+    persist_path: Optional[str] = None
+    _pending: list = PrivateAttr(default_factory=list)
+    _pending_vectors: list = PrivateAttr(default_factory=list)
+    _first_pending_at: Optional[float] = PrivateAttr(default=None)
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        documents = self._form_documents(inputs, outputs)
+        self._pending.extend(documents)
+        self._pending_vectors.extend([None] * len(documents))
+        if self._first_pending_at is None:
+            self._first_pending_at = time.monotonic()
+        if (len(self._pending) >= self.batch_size
+                or time.monotonic() - self._first_pending_at >= self.flush_interval):
+            self.flush()
+
+    async def asave_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        self.save_context(inputs, outputs)
+
+    def _embed_pending(self):
+        # Identical turns are embedded once
+        texts = list(dict.fromkeys(
+            doc.page_content for doc, vector in zip(self._pending, self._pending_vectors) if vector is None
+        ))
+        if not texts:
+            return
+        vectors = dict(zip(texts, self.retriever.vectorstore.embeddings.embed_documents(texts)))
+        self._pending_vectors = [
+            vectors[doc.page_content] if vector is None else vector
+            for doc, vector in zip(self._pending, self._pending_vectors)
+        ]
+
+    def flush(self):
+        if not self._pending:
+            return
+        self._embed_pending()
+        # Identical turns within a batch are stored once
+        unique = {}
+        for doc, vector in zip(self._pending, self._pending_vectors):
+            unique.setdefault(doc.page_content, (doc, vector))
+        self.retriever.vectorstore.add_embeddings(
+            [(text, vector) for text, (_, vector) in unique.items()],
+            metadatas=[doc.metadata for doc, _ in unique.values()],
+        )
+        self._pending = []
+        self._pending_vectors = []
+        self._first_pending_at = None
+
+    def persist(self):
+        # Save the index so a restart reloads vectors instead of re-embedding history
+        self.flush()
+        if self.persist_path:
+            self.retriever.vectorstore.save_local(self.persist_path)
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        if self._first_pending_at is not None and time.monotonic() - self._first_pending_at >= self.flush_interval:
+            self.flush()
+        query = inputs[self._get_prompt_input_key(inputs)]
+        vectorstore = self.retriever.vectorstore
+        if self.retriever.search_type != 'similarity':
+            # Only plain similarity search can be merged with pending turns by distance
+            self.flush()
+            docs = self.retriever.invoke(query) if vectorstore.index.ntotal else []
+            return self._documents_to_memory_variables(docs)
+        k = self.retriever.search_kwargs.get('k', 4)
+        query_vector = vectorstore.embeddings.embed_query(query)
+        scored = vectorstore.similarity_search_with_score_by_vector(query_vector, k) if vectorstore.index.ntotal else []
+        if self._pending:
+            self._embed_pending()
+            # Squared L2, the distance the IndexFlatL2 store reports
+            distances = ((np.asarray(self._pending_vectors) - np.asarray(query_vector)) ** 2).sum(axis=1)
+            scored += zip(self._pending, distances.tolist())
+        docs = [doc for doc, _ in sorted(scored, key=lambda item: item[1])[:k]]
+        return self._documents_to_memory_variables(docs)
+
+    async def aload_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        return self.load_memory_variables(inputs)
+
+class PeakAllocationTracker:
+    # Python heap allocated while a block runs, from tracemalloc: the peak and what is
+    # still held at the end, relative to the start. Unlike process RSS it leaves out
+    # the interpreter, imported libraries and earlier runs. Allocations made inside
+    # native libraries (such as FAISS's own index storage) aren't seen.
+    def __enter__(self):
+        self._started = not tracemalloc.is_tracing()
+        if self._started:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        self.baseline = tracemalloc.get_traced_memory()[0]
+        self.peak = self.retained = 0
+        return self
+
+    def __exit__(self, *exc):
+        current, peak = tracemalloc.get_traced_memory()
+        self.peak = peak - self.baseline
+        self.retained = current - self.baseline
+        if self._started:
+            tracemalloc.stop()
+
+def generate_synthetic_conversation(turns: int, seed: int = 0) -> List[tuple]:
+    # Deterministic conversation with varied message lengths
+    rng = random.Random(seed)
+    topics = ['python', 'web scraping', 'rate limiting', 'databases', 'testing', 'deployment', 'caching']
+    words = 'the a how do I handle implement configure with for and when using to in my project'.split()
+    conversation = []
+    for turn in range(turns):
+        topic = rng.choice(topics)
+        question = f'Turn {turn}: ' + ' '.join(rng.choices(words, k=rng.randint(5, 20))) + f' {topic}?'
+        answer = f'About {topic}: ' + ' '.join(rng.choices(words, k=rng.randint(20, 60))) + '.'
+        conversation.append((question, answer))
+    return conversation
+
+def _percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] if ordered else 0.0
+
 class MemoryManager:
-    def __init__(self):
-        self.llm = ChatOpenAI(model='gpt-3.5-turbo')
-        self.embeddings = OpenAIEmbeddings()
+    def __init__(self, llm=None, embeddings=None, embedding_cache_path: str = '.embedding_cache'):
+        self.llm = llm or get_chat_model(model='gpt-3.5-turbo')
+        self.embeddings = embeddings or OpenAIEmbeddings()
+        # Content-hash cache so identical texts and restarts never re-embed;
+        # embedding_cache_path=None keeps the cache in memory only
+        store = LocalFileStore(embedding_cache_path) if embedding_cache_path else InMemoryByteStore()
+        self.cached_embeddings = CacheBackedEmbeddings.from_bytes_store(
+            self.embeddings,
+            store,
+            namespace=getattr(self.embeddings, 'model', type(self.embeddings).__name__),
+            query_embedding_cache=True,
+            key_encoder='sha256',
+        )
+        self.memory_types = self._create_memory_types()
+
+    def _create_memory_types(self):
         # Initialize different memory types
-        self.memory_types = {
+        return {
             'buffer': ConversationBufferMemory(return_messages=True),
             'window': ConversationBufferWindowMemory(k=5, return_messages=True),
             'summary': ConversationSummaryMemory(llm=self.llm, return_messages=True),
@@ -26,25 +263,60 @@ class MemoryManager:
                 llm=self.llm,
                 max_token_limit=1000,
                 return_messages=True
-            )
+            ),
+            'token_budget': TokenBudgetMemory(
+                llm=self.llm,
+                max_token_limit=1000,
+                return_messages=True
+            ),
         }
     
-    def create_vector_memory(self, retriever_kwargs: dict=None):
+    def create_vector_memory(self, retriever_kwargs: dict=None, batch_size: int = 32,
+                             flush_interval: float = 1.0, persist_path: str = None):
         if retriever_kwargs is None:
             retriever_kwargs = {'k': 5}
-        # Create vector store for memory
-        vectorstore = FAISS.from_texts(
-            [''], # Start with empty store
-            embedding=self.embeddings,
-        )
-        retriever = vectorstore.as_retriever(**retriever_kwargs)
-        vector_memory = VectorStoreRetrieverMemory(
+        # Create vector store for memory, reloading a persisted index if there is one
+        if persist_path and os.path.exists(persist_path):
+            vectorstore = FAISS.load_local(
+                persist_path,
+                self.cached_embeddings,
+                allow_dangerous_deserialization=True,
+            )
+        else:
+            # Start with an empty index instead of embedding a placeholder text
+            dimension = len(self.cached_embeddings.embed_query('dimension probe'))
+            vectorstore = FAISS(
+                embedding_function=self.cached_embeddings,
+                index=faiss.IndexFlatL2(dimension),
+                docstore=InMemoryDocstore(),
+                index_to_docstore_id={},
+            )
+        retriever = vectorstore.as_retriever(search_kwargs=retriever_kwargs)
+        vector_memory = BatchedVectorMemory(
             retriever=retriever,
             memory_key='chat_history',
             input_key='input',
+            batch_size=batch_size,
+            flush_interval=flush_interval,
+            persist_path=persist_path,
         )
         return vector_memory
 
+    def benchmark_vector_writes(self, batch_sizes: tuple = (1, 8, 32, 128), turns: int = 512) -> List[dict]:
+        # Write throughput of vector memory at different batch sizes
+        results = []
+        for batch_size in batch_sizes:
+            # A fresh conversation per run so the embedding cache doesn't flatter later runs
+            conversation = generate_synthetic_conversation(turns, seed=batch_size)
+            memory = self.create_vector_memory(batch_size=batch_size, flush_interval=float('inf'))
+            start = time.perf_counter()
+            for human_msg, ai_msg in conversation:
+                memory.save_context({'input': human_msg}, {'output': ai_msg})
+            memory.flush()
+            elapsed = time.perf_counter() - start
+            results.append({'batch_size': batch_size, 'turns': turns, 'writes_per_second': turns / elapsed})
+        return results
+
     def compare_memory_performance(self, conversation_history: List[tuple]):
         # Compare different memory types with sample conversation
         results = {}
@@ -64,7 +336,91 @@ class MemoryManager:
             }
         return results
 
-if __name__ == "__main__":
+    def benchmark_memory_types(self, turn_counts: tuple = (10, 100, 1000, 10000), seed: int = 0) -> List[dict]:
+        # Drive every memory type (plus vector memory) through synthetic conversations.
+        # Each turn loads memory for the next question, then saves the exchange,
+        # the same order a chain with memory uses.
+        results = []
+        for turns in turn_counts:
+            conversation = generate_synthetic_conversation(turns, seed)
+            for name in [*self.memory_types, 'vector']:
+                results.append(self._benchmark_memory(name, conversation))
+        return results
+
+    def _new_memory(self, name: str):
+        return self.create_vector_memory() if name == 'vector' else self._create_memory_types()[name]
+
+    def _benchmark_memory(self, name: str, conversation: List[tuple]) -> dict:
+        llm_calls_before = getattr(self.llm, 'calls', None)
+        add_latencies = []
+        load_latencies = []
+        prompt_tokens = 0
+        memory = self._new_memory(name)
+        for human_msg, ai_msg in conversation:
+            start = time.perf_counter()
+            variables = memory.load_memory_variables({'input': human_msg})
+            load_latencies.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            memory.save_context({'input': human_msg}, {'output': ai_msg})
+            add_latencies.append(time.perf_counter() - start)
+        content = next(iter(variables.values()), '')
+        if not isinstance(content, str):
+            content = get_buffer_string(content)
+        prompt_tokens = self.llm.get_num_tokens(content) if content else 0
+        llm_calls = self.llm.calls - llm_calls_before if llm_calls_before is not None else None
+        # Allocations are measured on a second, fresh instance so tracing doesn't
+        # slow down the timed run; the embedding cache makes the vector rerun cheap
+        memory = self._new_memory(name)
+        with PeakAllocationTracker() as tracker:
+            for human_msg, ai_msg in conversation:
+                memory.load_memory_variables({'input': human_msg})
+                memory.save_context({'input': human_msg}, {'output': ai_msg})
+        return {
+            'memory_type': name,
+            'turns': len(conversation),
+            'add_latency_mean_ms': sum(add_latencies) / len(add_latencies) * 1000,
+            'add_latency_p95_ms': _percentile(add_latencies, 95) * 1000,
+            'load_latency_mean_ms': sum(load_latencies) / len(load_latencies) * 1000,
+            'load_latency_p95_ms': _percentile(load_latencies, 95) * 1000,
+            'peak_alloc_mb': tracker.peak / 2 ** 20,
+            'retained_mb': tracker.retained / 2 ** 20,
+            'prompt_tokens': prompt_tokens,
+            # Only available for models that count their own calls, like FakeChatModel
+            'llm_calls': llm_calls,
+        }
+
+def write_benchmark_results(results: List[dict], json_path: str = None, csv_path: str = None):
+    if json_path:
+        with open(json_path, 'w') as f:
+            json.dump(results, f, indent=2)
+    if csv_path and results:
+        with open(csv_path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(results[0].keys()))
+            writer.writeheader()
+            writer.writerows(results)
+
+def run_offline_benchmark(turn_counts: tuple = (10, 100, 1000, 10000)):
+    # Fake LLM and local embeddings so the benchmark runs without API keys
+    from fake_models import FakeChatModel, FakeEmbeddings
+    manager = MemoryManager(
+        llm=FakeChatModel(response='The human and AI discussed a Python project.', delay=0),
+        # Each embedding call costs a simulated 20ms round-trip
+        embeddings=FakeEmbeddings(delay=0.02),
+        embedding_cache_path=None,
+    )
+    results = manager.benchmark_memory_types(turn_counts)
+    write_benchmark_results(results, 'memory_benchmark.json', 'memory_benchmark.csv')
+    for row in results:
+        print(f"{row['memory_type']:>14} {row['turns']:>6} turns: "
+              f"add {row['add_latency_mean_ms']:.3f}ms, load {row['load_latency_mean_ms']:.3f}ms, "
+              f"{row['prompt_tokens']} prompt tokens, {row['llm_calls']} LLM calls, "
+              f"peak {row['peak_alloc_mb']:.2f}MB, retained {row['retained_mb']:.2f}MB")
+    for row in manager.benchmark_vector_writes():
+        print(f"vector memory batch_size={row['batch_size']}: {row['writes_per_second']:.0f} writes/s")
+
+if __name__ == '__main__' and sys.argv[1:2] == ['benchmark']:
+    run_offline_benchmark(tuple(int(n) for n in sys.argv[2:]) or (10, 100, 1000, 10000))
+elif __name__ == "__main__":
     sample_conversation = [
         ("Hi, I'm working on a Python project", "Hello! I'd be happy to help with your Python project. What specific aspect are you working on?"),
         ("I need to build a web scraper", "Great! For web scraping in Python, you have several options like BeautifulSoup, Scrapy, or Selenium. What type of website are you scraping?"),
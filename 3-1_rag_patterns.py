@@ -1,20 +1,629 @@
-from langchain_community.vectorstores import Chroma
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
+from langchain_openai import OpenAIEmbeddings
+from langchain_core.chat_history import InMemoryChatMessageHistory
+from langchain_core.documents import Document
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.runnables import RunnableLambda, RunnableParallel, RunnablePassthrough
+from langchain_core.runnables.history import RunnableWithMessageHistory
+from collections import OrderedDict, deque
+from model_registry import get_chat_model
+from response_cache import normalize_prompt
+from typing import AsyncIterator, Dict, Iterable, List, Tuple
+import asyncio
+import functools
+import hashlib
+import importlib
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+
+loading = importlib.import_module('3-2_document_loading_and_preprocessing')
+chunking = importlib.import_module('3-3_text_chunking_strategies')
+vector_embeddings = importlib.import_module('3-4_vector_embeddings_and_semantic_representation')
+
+# Keeps codes like ERR-4021, v2.3.1 and snake_case names as single tokens
+_TERM_PATTERN = re.compile(r'\w+(?:[-.:/]\w+)*')
+
+def tokenize(text: str) -> List[str]:
+    # Compound tokens are indexed whole and by their parts, so 'ERR-4021' matches
+    # both the exact code and a query for '4021'
+    terms = []
+    for match in _TERM_PATTERN.finditer(text.lower()):
+        term = match.group()
+        terms.append(term)
+        if not term.isalnum():
+            terms.extend(part for part in re.split(r'[-.:/]', term) if part)
+    return terms
+
+class BM25Index:
+    # Sparse keyword index over document IDs. Postings are frozen into CSR arrays
+    # (term offsets, int32 doc numbers, uint16 term frequencies); new documents
+    # go to per-term lists that are merged into the arrays before the next search.
+    # Deletes are tombstones, compacted once they make up half the index.
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.vocabulary = {}
+        self.ids = []
+        self.lengths = np.empty(0, dtype=np.int32)
+        self.deleted = np.empty(0, dtype=bool)
+        self._numbers = {}
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.postings = np.empty(0, dtype=np.int32)
+        self.frequencies = np.empty(0, dtype=np.uint16)
+        self._pending = {}
+        self._pending_lengths = []
+
+    def add(self, ids: List[str], texts: List[str]):
+        for doc_id, text in zip(ids, texts):
+            if doc_id in self._numbers:
+                self.delete([doc_id])
+            number = len(self.ids)
+            self._numbers[doc_id] = number
+            self.ids.append(doc_id)
+            terms = tokenize(text)
+            self._pending_lengths.append(len(terms))
+            counts = {}
+            for term in terms:
+                counts[term] = counts.get(term, 0) + 1
+            for term, count in counts.items():
+                term_id = self.vocabulary.setdefault(term, len(self.vocabulary))
+                self._pending.setdefault(term_id, []).append((number, min(count, 65535)))
+
+    def delete(self, ids: Iterable[str]):
+        self._freeze()
+        for doc_id in ids:
+            number = self._numbers.pop(doc_id, None)
+            if number is not None:
+                self.deleted[number] = True
+        if self.deleted.sum() * 2 > len(self.deleted) > 0:
+            self._compact()
+
+    def _freeze(self):
+        if not self._pending_lengths:
+            return
+        # Rebuild the CSR arrays once per batch of adds: O(total postings)
+        n_terms = len(self.vocabulary)
+        old_counts = np.diff(self.offsets)
+        counts = np.zeros(n_terms, dtype=np.int64)
+        counts[:len(old_counts)] = old_counts
+        for term_id, entries in self._pending.items():
+            counts[term_id] += len(entries)
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        postings = np.empty(offsets[-1], dtype=np.int32)
+        frequencies = np.empty(offsets[-1], dtype=np.uint16)
+        fill = offsets[:-1].copy()
+        for term_id in range(len(old_counts)):
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            postings[fill[term_id]:fill[term_id] + end - start] = self.postings[start:end]
+            frequencies[fill[term_id]:fill[term_id] + end - start] = self.frequencies[start:end]
+            fill[term_id] += end - start
+        for term_id, entries in self._pending.items():
+            entries = np.array(entries, dtype=np.int64)
+            postings[fill[term_id]:fill[term_id] + len(entries)] = entries[:, 0]
+            frequencies[fill[term_id]:fill[term_id] + len(entries)] = entries[:, 1]
+        self.offsets, self.postings, self.frequencies = offsets, postings, frequencies
+        self.lengths = np.concatenate([self.lengths, np.array(self._pending_lengths, dtype=np.int32)])
+        self.deleted = np.concatenate([self.deleted, np.zeros(len(self._pending_lengths), dtype=bool)])
+        self._pending = {}
+        self._pending_lengths = []
+
+    def _compact(self):
+        keep = ~self.deleted
+        renumber = np.cumsum(keep) - 1
+        live = keep[self.postings]
+        term_ids = np.repeat(np.arange(len(self.offsets) - 1), np.diff(self.offsets))[live]
+        self.postings = renumber[self.postings[live]].astype(np.int32)
+        self.frequencies = self.frequencies[live]
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(term_ids, minlength=len(self.offsets) - 1))])
+        self.ids = [doc_id for doc_id, kept in zip(self.ids, keep) if kept]
+        self._numbers = {doc_id: number for number, doc_id in enumerate(self.ids)}
+        self.lengths = self.lengths[keep]
+        self.deleted = np.zeros(len(self.ids), dtype=bool)
+
+    def __len__(self) -> int:
+        return len(self._numbers)
+
+    def search(self, query: str, k: int = 4) -> List[Tuple[str, float]]:
+        self._freeze()
+        n_live = len(self)
+        term_ids = {self.vocabulary[term] for term in tokenize(query) if term in self.vocabulary}
+        if not n_live or not term_ids:
+            return []
+        average_length = self.lengths[~self.deleted].mean()
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for term_id in term_ids:
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            docs = self.postings[start:end]
+            tf = self.frequencies[start:end].astype(np.float32)
+            idf = np.log(1 + (n_live - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self.lengths[docs] / average_length)
+            scores[docs] += idf * tf * (self.k1 + 1) / (tf + norm)
+        scores[self.deleted] = 0
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates])]
+        return [(self.ids[number], float(scores[number])) for number in candidates]
+
+    def save(self, folder: str):
+        self._freeze()
+        if self.deleted.any():
+            self._compact()
+        for name in ('offsets', 'postings', 'frequencies', 'lengths'):
+            vector_embeddings.save_array(folder, f'bm25_{name}.npy', getattr(self, name))
+        with open(os.path.join(folder, 'bm25.json.tmp'), 'w') as f:
+            json.dump({'k1': self.k1, 'b': self.b, 'vocabulary': self.vocabulary, 'ids': self.ids}, f)
+        os.replace(os.path.join(folder, 'bm25.json.tmp'), os.path.join(folder, 'bm25.json'))
+
+    @classmethod
+    def load(cls, folder: str) -> 'BM25Index':
+        with open(os.path.join(folder, 'bm25.json')) as f:
+            settings = json.load(f)
+        index = cls(settings['k1'], settings['b'])
+        index.vocabulary = settings['vocabulary']
+        index.ids = settings['ids']
+        index._numbers = {doc_id: number for number, doc_id in enumerate(index.ids)}
+        for name in ('offsets', 'postings', 'frequencies', 'lengths'):
+            setattr(index, name, np.load(os.path.join(folder, f'bm25_{name}.npy')))
+        index.deleted = np.zeros(len(index.ids), dtype=bool)
+        return index
+
+def reciprocal_rank_fusion(rankings: List[List], k: int = 60, limit: int = None) -> List:
+    # Score each Document by sum(1 / (k + rank)) over the rankings it appears in
+    scores = {}
+    documents = {}
+    for ranking in rankings:
+        for rank, document in enumerate(ranking, start=1):
+            key = document.id or document.page_content
+            documents.setdefault(key, document)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    ordered = sorted(scores, key=scores.get, reverse=True)[:limit]
+    return [documents[key] for key in ordered]
+
+_MINHASH_PRIME = np.uint64(4294967311)
+
+@functools.lru_cache(maxsize=None)
+def _minhash_permutations(num_perm: int, seed: int) -> Tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 2 ** 32, num_perm, dtype=np.uint64)
+    b = rng.integers(0, 2 ** 32, num_perm, dtype=np.uint64)
+    return a[:, None], b[:, None]
+
+# Retrieved chunks repeat across queries, so signatures are memoized per text
+@functools.lru_cache(maxsize=65536)
+def minhash_signature(text: str, num_perm: int = 64, shingle_size: int = 3, seed: int = 0) -> np.ndarray:
+    # MinHash over word shingles; the fraction of equal entries between two
+    # signatures estimates the Jaccard similarity of their shingle sets
+    words = re.findall(r'\w+', text.lower())
+    shingles = {' '.join(words[i:i + shingle_size]) for i in range(max(1, len(words) - shingle_size + 1))}
+    hashes = np.array([
+        int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=4).digest(), 'little') >> 1
+        for shingle in shingles
+    ], dtype=np.uint64)
+    a, b = _minhash_permutations(num_perm, seed)
+    return ((a * hashes[None, :] + b) % _MINHASH_PRIME).min(axis=1)
+
+class ContextPacker:
+    # Turns ranked retrieval results into the prompt context:
+    # 1. merge overlapping or adjacent chunks of the same source (via the start_index /
+    #    end_index offsets the 3-3 chunkers record), so overlap is sent once
+    # 2. drop near-duplicates whose MinHash Jaccard estimate reaches similarity_threshold
+    # 3. add passages best-first while they fit in max_tokens
+    def __init__(self, max_tokens: int = 2000, similarity_threshold: float = 0.8, token_counter=None,
+                 separator: str = '\n\n'):
+        self.max_tokens = max_tokens
+        self.similarity_threshold = similarity_threshold
+        self.token_counter = token_counter or (lambda text: len(text) // 4 + 1)
+        self.separator = separator
+        self.last_stats = {}
+
+    @staticmethod
+    def _source_key(document: Document):
+        metadata = document.metadata
+        if 'start_index' not in metadata or 'end_index' not in metadata:
+            return None
+        return metadata.get('source'), metadata.get('page'), metadata.get('line')
+
+    def merge_adjacent(self, documents: List[Document]) -> List[Tuple[int, str]]:
+        # Returns (best rank, text) passages; unmergeable chunks pass through
+        passages = []
+        groups = {}
+        for rank, document in enumerate(documents):
+            key = self._source_key(document)
+            if key is None:
+                passages.append((rank, document.page_content))
+            else:
+                groups.setdefault(key, []).append((rank, document))
+        for members in groups.values():
+            members.sort(key=lambda member: member[1].metadata['start_index'])
+            rank, first = members[0]
+            text, end = first.page_content, first.metadata['end_index']
+            for next_rank, document in members[1:]:
+                start = document.metadata['start_index']
+                if start <= end:
+                    text += document.page_content[end - start:]
+                    end = max(end, document.metadata['end_index'])
+                    rank = min(rank, next_rank)
+                else:
+                    passages.append((rank, text))
+                    rank, text, end = next_rank, document.page_content, document.metadata['end_index']
+            passages.append((rank, text))
+        passages.sort()
+        return passages
+
+    def pack(self, documents: List[Document]) -> str:
+        passages = self.merge_adjacent(documents)
+        kept, signatures = [], []
+        tokens = duplicates = over_budget = 0
+        separator_tokens = self.token_counter(self.separator)
+        for _, text in passages:
+            signature = minhash_signature(text)
+            if signatures and (np.vstack(signatures) == signature).mean(axis=1).max() >= self.similarity_threshold:
+                duplicates += 1
+                continue
+            cost = self.token_counter(text) + (separator_tokens if kept else 0)
+            if tokens + cost > self.max_tokens:
+                # A shorter, lower-ranked passage may still fit
+                over_budget += 1
+                continue
+            signatures.append(signature)
+            kept.append(text)
+            tokens += cost
+        self.last_stats = {'chunks': len(documents), 'merged': len(documents) - len(passages),
+                           'duplicates': duplicates, 'over_budget': over_budget, 'tokens': tokens}
+        return self.separator.join(kept)
+
+class LexicalOverlapScorer:
+    # Dependency-free stand-in for a cross-encoder: the share of query terms a
+    # passage covers, with a small bonus for term density. Good enough for tests
+    # and keyword-heavy queries.
+    def __call__(self, query: str, texts: List[str]) -> List[float]:
+        query_terms = set(tokenize(query))
+        if not query_terms:
+            return [0.0] * len(texts)
+        scores = []
+        for text in texts:
+            terms = tokenize(text)
+            matched = query_terms.intersection(terms)
+            density = sum(term in query_terms for term in terms) / (len(terms) or 1)
+            scores.append(len(matched) / len(query_terms) + 0.1 * density)
+        return scores
+
+class CrossEncoderScorer:
+    # Local cross-encoder via sentence-transformers (optional dependency)
+    def __init__(self, model_name: str = 'cross-encoder/ms-marco-MiniLM-L-6-v2', batch_size: int = 32):
+        try:
+            from sentence_transformers import CrossEncoder
+        except ImportError:
+            raise ImportError('sentence-transformers is required for CrossEncoderScorer: '
+                              'pip install sentence-transformers')
+        self.model = CrossEncoder(model_name)
+        self.batch_size = batch_size
+
+    def __call__(self, query: str, texts: List[str]) -> List[float]:
+        return [float(score) for score in self.model.predict([(query, text) for text in texts], batch_size=self.batch_size)]
+
+class Reranker:
+    # Rescores top_n retrieved candidates with scorer(query, texts) and keeps the
+    # best k. Scores are cached per (query hash, chunk ID), so repeated queries and
+    # later pages of the same query only score chunks they have not seen.
+    def __init__(self, scorer=None, top_n: int = 20, cache_size: int = 100000, latency_window: int = 1000):
+        self.scorer = scorer or LexicalOverlapScorer()
+        self.top_n = top_n
+        self.cache_size = cache_size
+        self._scores = OrderedDict()
+        self._latencies = deque(maxlen=latency_window)
+        self._lock = threading.Lock()
+        self.stats = {'calls': 0, 'candidates': 0, 'scored': 0, 'cache_hits': 0}
+
+    @staticmethod
+    def _chunk_key(document: Document) -> str:
+        return document.id or hashlib.sha256(document.page_content.encode('utf-8')).hexdigest()
+
+    def rerank(self, query: str, documents: List[Document], k: int = 4, offset: int = 0) -> List[Document]:
+        start = time.perf_counter()
+        query_hash = hashlib.sha256(normalize_prompt(query).encode('utf-8')).hexdigest()
+        keys = [(query_hash, self._chunk_key(document)) for document in documents]
+        with self._lock:
+            scores = {key: self._scores[key] for key in keys if key in self._scores}
+            for key in scores:
+                self._scores.move_to_end(key)
+        missing = [i for i, key in enumerate(keys) if key not in scores]
+        if missing:
+            # One scorer call per query for every uncached candidate
+            fresh = self.scorer(query, [documents[i].page_content for i in missing])
+            with self._lock:
+                for i, score in zip(missing, fresh):
+                    scores[keys[i]] = score
+                    self._scores[keys[i]] = score
+                while len(self._scores) > self.cache_size:
+                    self._scores.popitem(last=False)
+        ranked = sorted(range(len(documents)), key=lambda i: scores[keys[i]], reverse=True)
+        with self._lock:
+            self.stats['calls'] += 1
+            self.stats['candidates'] += len(documents)
+            self.stats['scored'] += len(missing)
+            self.stats['cache_hits'] += len(documents) - len(missing)
+            self._latencies.append(time.perf_counter() - start)
+        return [documents[i] for i in ranked[offset:offset + k]]
+
+    def latency_report(self) -> dict:
+        latencies = np.array(self._latencies) * 1000 if self._latencies else np.zeros(1)
+        candidates = self.stats['candidates']
+        return {
+            **self.stats,
+            'cache_hit_rate': self.stats['cache_hits'] / candidates if candidates else 0.0,
+            'p50_ms': float(np.percentile(latencies, 50)),
+            'p95_ms': float(np.percentile(latencies, 95)),
+        }
+
+def chunk_id(source: str, chunk_hash: str, occurrence: int) -> str:
+    # Deterministic vector ID: the same chunk text in the same file always maps to
+    # the same ID, so re-runs can diff ID sets instead of comparing embeddings
+    return hashlib.sha256(f'{source}\x00{chunk_hash}\x00{occurrence}'.encode('utf-8')).hexdigest()[:32]
+
+class IncrementalIndexer:
+    # Keeps a JSON manifest of path -> {file hash, {vector ID: chunk hash}} next to the
+    # vector store. A run re-parses only files whose hash changed (via the 3-2 loader's
+    # known_hashes), embeds only chunk IDs not already indexed, and deletes the IDs of
+    # chunks and files that disappeared. Unchanged files cost one read and one hash.
+    def __init__(self, vectorstore, manifest_path: str, chunker=None, max_workers: int = None,
+                 embed_batch_size: int = 256, keyword_index: BM25Index = None):
+        self.vectorstore = vectorstore
+        self.keyword_index = keyword_index
+        self.manifest_path = manifest_path
+        self.chunker = chunker or chunking.RecursiveChunker()
+        self.max_workers = max_workers
+        self.embed_batch_size = embed_batch_size
+        self.manifest = self._load_manifest()
+        self.stats = {}
+
+    def _load_manifest(self) -> Dict[str, dict]:
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path) as f:
+            return json.load(f)['files']
+
+    def _save_manifest(self):
+        with open(self.manifest_path + '.tmp', 'w') as f:
+            json.dump({'version': 1, 'files': self.manifest}, f)
+        os.replace(self.manifest_path + '.tmp', self.manifest_path)
+
+    def _chunk_file(self, source: str, documents: List) -> Dict[str, object]:
+        # vector ID -> chunk Document, with chunk hash and ID in the metadata
+        chunks = {}
+        occurrences = {}
+        for chunk in self.chunker.chunk_documents(documents):
+            chunk_hash = hashlib.sha256(chunk.page_content.encode('utf-8')).hexdigest()
+            occurrence = occurrences.get(chunk_hash, 0)
+            occurrences[chunk_hash] = occurrence + 1
+            doc_id = chunk_id(source, chunk_hash, occurrence)
+            chunk.metadata['chunk_hash'] = chunk_hash
+            chunk.id = doc_id
+            chunks[doc_id] = chunk
+        return chunks
+
+    def _files(self, documents: Iterable) -> Iterable[tuple]:
+        # The loader yields each file's documents together; group them by source
+        source, group = None, []
+        for document in documents:
+            if document.metadata['source'] != source and group:
+                yield source, group
+                group = []
+            source = document.metadata['source']
+            group.append(document)
+        if group:
+            yield source, group
+
+    def _flush(self, pending: list):
+        if pending:
+            self.vectorstore.add_documents(pending, ids=[doc.id for doc in pending])
+            if self.keyword_index is not None:
+                self.keyword_index.add([doc.id for doc in pending], [doc.page_content for doc in pending])
+            self.stats['chunks_embedded'] += len(pending)
+            pending.clear()
+
+    def index_directory(self, root: str) -> dict:
+        start = time.perf_counter()
+        self.stats = {'files': 0, 'files_changed': 0, 'files_removed': 0,
+                      'chunks_embedded': 0, 'chunks_deleted': 0, 'chunks_unchanged': 0}
+        loader = loading.ParallelDirectoryLoader(
+            root, max_workers=self.max_workers,
+            known_hashes={path: entry['hash'] for path, entry in self.manifest.items()},
+        )
+        stale = []
+        pending = []
+        changed = set()
+        for source, documents in self._files(loader.lazy_load()):
+            changed.add(source)
+            old = self.manifest.get(source, {}).get('chunks', {})
+            chunks = self._chunk_file(source, documents)
+            stale.extend(doc_id for doc_id in old if doc_id not in chunks)
+            for doc_id, chunk in chunks.items():
+                if doc_id in old:
+                    self.stats['chunks_unchanged'] += 1
+                else:
+                    pending.append(chunk)
+            self.manifest[source] = {
+                'hash': documents[0].metadata['content_hash'],
+                'chunks': {doc_id: chunk.metadata['chunk_hash'] for doc_id, chunk in chunks.items()},
+            }
+            if len(pending) >= self.embed_batch_size:
+                self._flush(pending)
+        self._flush(pending)
+        # Changed files that now parse to nothing, e.g. an emptied JSONL file
+        for path, digest in loader.file_hashes.items():
+            if path not in changed and path not in loader.errors and self.manifest.get(path, {}).get('hash') != digest:
+                stale.extend(self.manifest.get(path, {}).get('chunks', {}))
+                self.manifest[path] = {'hash': digest, 'chunks': {}}
+                changed.add(path)
+        # Files gone from disk; files that failed to parse keep their previous vectors
+        for path in list(self.manifest):
+            if path not in loader.file_hashes and path not in loader.errors:
+                stale.extend(self.manifest.pop(path)['chunks'])
+                self.stats['files_removed'] += 1
+        if stale:
+            self.vectorstore.delete(stale)
+            if self.keyword_index is not None:
+                self.keyword_index.delete(stale)
+        self.stats['chunks_deleted'] = len(stale)
+        self.stats['files'] = loader.stats['files']
+        self.stats['files_changed'] = len(changed)
+        self.stats['chunks_unchanged'] += sum(
+            len(entry['chunks']) for path, entry in self.manifest.items() if path not in changed
+        )
+        self.stats['seconds'] = time.perf_counter() - start
+        return self.stats
 
 class RAGArchitecture:
-    def __init__(self, pattern_type='basic'):
-        self.embeddings = OpenAIEmbeddings()
-        self.llm = ChatOpenAI(model='gpt-3.5-turbo')
+    # index_backend picks the vector index from INDEX_BACKENDS in 3-4: 'exact' for
+    # small corpora, 'ivf' / 'faiss_hnsw' / 'faiss_ivf' for millions of chunks.
+    # index_kwargs carry the recall/latency knobs (nprobe, ef_search, n_lists).
+    # persist_directory keeps the vector store, keyword index and ingestion manifest
+    # between runs. The 'advanced' pattern fuses dense and BM25 results with RRF.
+    # The 'conversational' pattern condenses follow-ups with condense_llm (default: llm),
+    # caching up to rewrite_cache_size rewrites, and reuses a session's recent retrieval
+    # when the new standalone query normalizes to the same text as one of its last
+    # reuse_window queries. semantic_reuse (opt-in, needs the embedding model) also
+    # reuses when the query embedding is within reuse_threshold of a recent one and
+    # both name the same identifiers (anything containing a digit, e.g. ERR-0042).
+    # With a reranker, every pattern over-fetches reranker.top_n candidates and keeps
+    # the k best by reranker score.
+    def __init__(self, pattern_type='basic', retriever=None, index_backend='exact', index_kwargs=None,
+                 search_kwargs=None, persist_directory=None, embeddings=None, rrf_k: int = 60,
+                 llm=None, condense_llm=None, history_window: int = 6, rewrite_cache_size: int = 1024,
+                 reuse_window: int = 4, semantic_reuse: bool = False, reuse_threshold: float = 0.95,
+                 context_packer: ContextPacker = None, reranker: Reranker = None):
+        # Only the built-in vector store embeds; an injected retriever brings its own
+        self.embeddings = embeddings or (OpenAIEmbeddings() if retriever is None else None)
+        if semantic_reuse and self.embeddings is None:
+            raise ValueError('Semantic reuse needs an embedding model')
+        # Models are created on first use, so retrieval-only use needs no API key
+        self._llm = llm
+        self._condense_llm = condense_llm
+        self.history_window = history_window
+        self.rewrite_cache_size = rewrite_cache_size
+        self.reuse_window = reuse_window
+        self.semantic_reuse = semantic_reuse
+        self.reuse_threshold = reuse_threshold
+        # Dedupes, merges and budgets retrieved chunks before they reach the prompt
+        self.context_packer = context_packer or ContextPacker()
+        self.chat_histories = {}
+        self._rewrites = OrderedDict()
+        self._recent_retrievals = {}
+        self.conversation_stats = {'turns': 0, 'rewrites': 0, 'rewrite_cache_hits': 0,
+                                   'retrievals': 0, 'retrieval_reuses': 0}
         self.pattern_type = pattern_type
-        # Initialize based on pattern_type
-        if pattern_type == 'basic':
-            self.chain = self._create_basic_rag()
-        elif pattern_type == 'advanced':
-            self.chain = self._create_advanced_rag()
-        elif pattern_type == 'conversational':
-            self.chain = self._create_conversational_rag()
+        self.persist_directory = persist_directory
+        self.reranker = reranker
+        search_kwargs = dict(search_kwargs or {'k': 4})
+        self.k = search_kwargs.get('k', 4)
+        self.fetch_k = max(self.k, reranker.top_n) if reranker else self.k
+        search_kwargs['k'] = self.fetch_k
+        self.vectorstore = None
+        if retriever is None:
+            if persist_directory and os.path.exists(os.path.join(persist_directory, 'store.json')):
+                self.vectorstore = vector_embeddings.NumpyVectorStore.load_local(persist_directory, self.embeddings)
+            else:
+                self.vectorstore = vector_embeddings.NumpyVectorStore(
+                    self.embeddings, index_backend=index_backend, index_kwargs=index_kwargs
+                )
+            retriever = self.vectorstore.as_retriever(search_kwargs=search_kwargs)
+        # Any retriever returning Documents
+        self.retriever = retriever
+        self.rrf_k = rrf_k
+        self.keyword_index = BM25Index()
+        if persist_directory and os.path.exists(os.path.join(persist_directory, 'bm25.json')):
+            self.keyword_index = BM25Index.load(persist_directory)
+        elif self.vectorstore is not None and self.vectorstore.ids:
+            self.keyword_index.add(self.vectorstore.ids, [doc.page_content for doc in self.vectorstore.documents])
+        if pattern_type == 'advanced':
+            self.hybrid_retriever = self._with_rerank(self._create_hybrid_retriever())
+        # The chain for pattern_type is built on first access
+        self._chain = None
+        self._answer_prompt = None
+        self._condense_chain = None
+
+    @property
+    def llm(self):
+        if self._llm is None:
+            self._llm = get_chat_model(model='gpt-3.5-turbo')
+        return self._llm
+
+    @property
+    def condense_llm(self):
+        return self._condense_llm or self.llm
+
+    @property
+    def condense_chain(self):
+        # Rewrites a follow-up as a standalone question; used by the conversational chain and astream
+        if self._condense_chain is None:
+            self._condense_chain = ChatPromptTemplate.from_messages([
+                ('system', 'Rewrite the latest user question as a standalone question using the conversation. '
+                           'Return only the question.'),
+                ('placeholder', '{chat_history}'),
+                ('human', '{question}'),
+            ]) | self.condense_llm
+        return self._condense_chain
+
+    @property
+    def chain(self):
+        if self._chain is None:
+            if self.pattern_type == 'basic':
+                self._chain = self._create_basic_rag()
+            elif self.pattern_type == 'advanced':
+                self._chain = self._create_advanced_rag()
+            elif self.pattern_type == 'conversational':
+                self._chain = self._create_conversational_rag()
+        return self._chain
+
+    @property
+    def answer_prompt(self):
+        # Set while building the chain
+        if self._answer_prompt is None:
+            self.chain
+        return self._answer_prompt
+
+    def add_documents(self, documents):
+        # Retrieved contexts held for reuse may be stale once the corpus changes
+        self._recent_retrievals.clear()
+        ids = self.vectorstore.add_documents(documents)
+        self.keyword_index.add(ids, [doc.page_content for doc in documents])
+        return ids
+
+    def ingest(self, root: str, chunker=None, max_workers: int = None) -> dict:
+        # Incremental: only new or changed chunks under root are embedded
+        if self.persist_directory is None:
+            raise ValueError('ingest() needs a persist_directory for its manifest')
+        os.makedirs(self.persist_directory, exist_ok=True)
+        self._recent_retrievals.clear()
+        indexer = IncrementalIndexer(
+            self.vectorstore, os.path.join(self.persist_directory, 'manifest.json'),
+            chunker=chunker, max_workers=max_workers, keyword_index=self.keyword_index,
+        )
+        stats = indexer.index_directory(root)
+        if stats['chunks_embedded'] or stats['chunks_deleted'] or not os.path.exists(indexer.manifest_path):
+            self.vectorstore.save_local(self.persist_directory)
+            self.keyword_index.save(self.persist_directory)
+            indexer._save_manifest()
+        return stats
+
+    def select_documents(self, query: str, documents: List[Document]) -> List[Document]:
+        if self.reranker is None:
+            return documents
+        return self.reranker.rerank(query, documents, self.k)
+
+    def _with_rerank(self, retriever):
+        return (
+            RunnableParallel({'query': RunnablePassthrough(), 'documents': retriever})
+            | RunnableLambda(lambda inputs: self.select_documents(inputs['query'], inputs['documents']))
+        )
 
     def _create_basic_rag(self):
         prompt = ChatPromptTemplate.from_template("""
@@ -23,18 +632,528 @@ class RAGArchitecture:
             Question: {question}
             Answer:
         """)
-        def format_docs(docs):
-            return '\n\n'.join(doc.page_content for doc in docs)
+        self._answer_prompt = prompt
         return (
-            {'context': self.retriever | format_docs, 'question': RunnablePassthrough()}
+            {'context': self._with_rerank(self.retriever) | self.context_packer.pack, 'question': RunnablePassthrough()}
             | prompt
             | self.llm
         )
 
+    def keyword_search(self, query: str, k: int = None) -> List:
+        hits = self.keyword_index.search(query, k or self.k)
+        if self.vectorstore is None:
+            return []
+        return self.vectorstore.get_by_ids([doc_id for doc_id, _ in hits])
+
+    def _create_hybrid_retriever(self):
+        # RunnableParallel runs both legs concurrently (threads for invoke, gather
+        # for ainvoke), so latency tracks the slower leg rather than the sum
+        fetch_k = max(self.k * 2, self.fetch_k)
+        dense = self.retriever
+        if self.vectorstore is not None:
+            dense = self.vectorstore.as_retriever(search_kwargs={'k': fetch_k})
+        return (
+            RunnableParallel({
+                'dense': dense,
+                'sparse': RunnableLambda(lambda query: self.keyword_search(query, fetch_k)),
+            })
+            | RunnableLambda(lambda legs: reciprocal_rank_fusion(
+                [legs['dense'], legs['sparse']], k=self.rrf_k, limit=self.fetch_k,
+            ))
+        )
+
     def _create_advanced_rag(self):
-        # Implement advanced RAG with multiple retrieval sources
-        pass
+        # Dense + BM25 retrieval fused with reciprocal rank fusion
+        prompt = ChatPromptTemplate.from_template("""
+            Answer the question based on the following context:
+            Context: {context}
+            Question: {question}
+            Answer:
+        """)
+        self._answer_prompt = prompt
+        return (
+            {'context': self.hybrid_retriever | self.context_packer.pack, 'question': RunnablePassthrough()}
+            | prompt
+            | self.llm
+        )
     
+    def retrieve_batch(self, questions: List[str], embed_batch_size: int = None) -> List[list]:
+        # Embeds questions in batched calls and searches the whole query matrix at
+        # once; the advanced pattern fuses each row with its BM25 results
+        if self.vectorstore is None:
+            return [self.select_documents(question, row) for question, row in zip(questions, self.retriever.batch(questions))]
+        embed_batch_size = embed_batch_size or self.vectorstore.embedding_batch_size
+        vectors = []
+        for start in range(0, len(questions), embed_batch_size):
+            vectors.extend(self.embeddings.embed_documents(questions[start:start + embed_batch_size]))
+        fetch_k = max(self.k * 2, self.fetch_k) if self.pattern_type == 'advanced' else self.fetch_k
+        results = self.vectorstore.similarity_search_by_vector_batch(vectors, fetch_k)
+        candidates = [[doc for doc, _ in row] for row in results]
+        if self.pattern_type == 'advanced':
+            candidates = [
+                reciprocal_rank_fusion([row, self.keyword_search(question, fetch_k)], k=self.rrf_k, limit=self.fetch_k)
+                for row, question in zip(candidates, questions)
+            ]
+        return [self.select_documents(question, row) for question, row in zip(questions, candidates)]
+
+    def batch_query(self, questions: List[str], max_concurrency: int = 32, embed_batch_size: int = None) -> list:
+        # Bulk answering: identical questions (ignoring whitespace) are answered once,
+        # retrieval runs as one batched pass, and generation is dispatched with at
+        # most max_concurrency calls in flight. A failed generation is returned as its
+        # exception in place of the answer rather than failing the batch.
+        start = time.perf_counter()
+        unique = {}
+        keys = []
+        for question in questions:
+            key = ' '.join(question.split())
+            unique.setdefault(key, question)
+            keys.append(key)
+        unique_questions = list(unique.values())
+        contexts = [self.context_packer.pack(documents) for documents in self.retrieve_batch(unique_questions, embed_batch_size)]
+        retrieved = time.perf_counter()
+        answers = (self.answer_prompt | self.llm).batch(
+            [{'context': context, 'question': question} for context, question in zip(contexts, unique_questions)],
+            config={'max_concurrency': max_concurrency},
+            return_exceptions=True,
+        )
+        by_key = dict(zip(unique, answers))
+        self.last_batch_stats = {
+            'questions': len(questions),
+            'unique': len(unique_questions),
+            'retrieval_seconds': retrieved - start,
+            'generation_seconds': time.perf_counter() - retrieved,
+        }
+        return [by_key[key] for key in keys]
+
+    def get_session_history(self, session_id: str) -> InMemoryChatMessageHistory:
+        if session_id not in self.chat_histories:
+            self.chat_histories[session_id] = InMemoryChatMessageHistory()
+        return self.chat_histories[session_id]
+
+    def condense_question(self, question: str, chat_history: list) -> str:
+        # First turns are already standalone; follow-ups are rewritten once per
+        # (recent history, question) and served from an LRU cache afterwards
+        history = chat_history[-self.history_window:]
+        if not history:
+            return question
+        key = hashlib.sha256(normalize_prompt(
+            '\n'.join(f'{message.type}: {message.content}' for message in history) + f'\nhuman: {question}'
+        ).encode('utf-8')).hexdigest()
+        if key in self._rewrites:
+            self._rewrites.move_to_end(key)
+            self.conversation_stats['rewrite_cache_hits'] += 1
+            return self._rewrites[key]
+        standalone = self.condense_chain.invoke({'chat_history': history, 'question': question}).content.strip()
+        self.conversation_stats['rewrites'] += 1
+        self._rewrites[key] = standalone
+        if len(self._rewrites) > self.rewrite_cache_size:
+            self._rewrites.popitem(last=False)
+        return standalone
+
+    def _reusable_retrieval(self, query: str, session_id: str):
+        # Returns ((normalized query, identifiers, unit embedding or None), documents or None).
+        # An exact match after normalization is always reused. A merely similar query is
+        # only reused with semantic_reuse, and only if it names the same identifiers:
+        # 'restart ERR-0041' and 'restart ERR-0042' embed almost identically
+        text = normalize_prompt(query)
+        identifiers = frozenset(re.findall(r'\w*\d\w*', text))
+        recent = self._recent_retrievals.setdefault(session_id, deque(maxlen=self.reuse_window))
+        for (previous, _, _), documents in recent:
+            if previous == text:
+                self.conversation_stats['retrieval_reuses'] += 1
+                return (text, identifiers, None), documents
+        vector = None
+        if self.semantic_reuse:
+            vector = np.asarray(self.embeddings.embed_query(text), dtype=np.float32)
+            vector /= np.linalg.norm(vector) or 1.0
+            for (_, previous_identifiers, previous_vector), documents in recent:
+                if (previous_vector is not None and previous_identifiers == identifiers
+                        and float(vector @ previous_vector) >= self.reuse_threshold):
+                    self.conversation_stats['retrieval_reuses'] += 1
+                    return (text, identifiers, vector), documents
+        return (text, identifiers, vector), None
+
+    def _remember_retrieval(self, session_id: str, key: tuple, documents: list):
+        self.conversation_stats['retrievals'] += 1
+        self._recent_retrievals[session_id].append((key, documents))
+
+    def retrieve_for_session(self, query: str, session_id: str) -> list:
+        # Reuse a recent retrieval from this session (see _reusable_retrieval), skipping
+        # the vector search and, for an exact repeat, the embedding call too
+        key, documents = self._reusable_retrieval(query, session_id)
+        if documents is None:
+            vector = key[2]
+            if vector is not None and self.vectorstore is not None:
+                # Already embedded for the reuse check; search with it instead of re-embedding
+                candidates = self.vectorstore.similarity_search_by_vector(vector.tolist(), k=self.fetch_k)
+            else:
+                candidates = self.retriever.invoke(query)
+            documents = self.select_documents(query, candidates)
+            self._remember_retrieval(session_id, key, documents)
+        return documents
+
+    @staticmethod
+    def citation(document: Document) -> dict:
+        metadata = document.metadata
+        cited = {'id': document.id, 'snippet': document.page_content[:200]}
+        for key in ('source', 'title', 'page', 'line', 'start_index', 'end_index'):
+            if key in metadata:
+                cited[key] = metadata[key]
+        return cited
+
+    def _retrieval_sources(self) -> dict:
+        # name -> async retrieval call for every source the pattern uses
+        fetch_k = max(self.k * 2, self.fetch_k) if self.pattern_type == 'advanced' else self.fetch_k
+        dense = self.retriever
+        if self.vectorstore is not None:
+            dense = self.vectorstore.as_retriever(search_kwargs={'k': fetch_k})
+        sources = {'dense': dense.ainvoke}
+        if self.pattern_type == 'advanced':
+            sources['keyword'] = lambda query: asyncio.to_thread(self.keyword_search, query, fetch_k)
+        return sources
+
+    async def astream(self, question: str, session_id: str = 'default') -> AsyncIterator[dict]:
+        # Streams events for a UI:
+        #   {'type': 'citations', 'source': name, 'citations': [...]} as each source returns
+        #   {'type': 'context', 'citations': [...]} once fused / reranked / packed
+        #   {'type': 'token', 'content': ...} for each answer chunk
+        #   {'type': 'done', 'stats': {...}} with timings, also kept in last_stream_stats
+        start = time.perf_counter()
+        history = []
+        query = question
+        if self.pattern_type == 'conversational':
+            history = self.get_session_history(session_id).messages
+            query = await asyncio.to_thread(self.condense_question, question, history)
+            self.conversation_stats['turns'] += 1
+        first_citation_at = None
+        key, documents = (None, None)
+        if self.pattern_type == 'conversational':
+            key, documents = await asyncio.to_thread(self._reusable_retrieval, query, session_id)
+        if documents is None:
+            tasks = {asyncio.ensure_future(retrieve(query)): name for name, retrieve in self._retrieval_sources().items()}
+            results = {}
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    results[tasks[task]] = task.result()
+                    first_citation_at = first_citation_at or time.perf_counter()
+                    yield {'type': 'citations', 'source': tasks[task],
+                           'citations': [self.citation(doc) for doc in results[tasks[task]]]}
+            if len(results) > 1:
+                candidates = reciprocal_rank_fusion(list(results.values()), k=self.rrf_k, limit=self.fetch_k)
+            else:
+                candidates = results['dense']
+            documents = await asyncio.to_thread(self.select_documents, query, candidates)
+            if key is not None:
+                self._remember_retrieval(session_id, key, documents)
+        context = self.context_packer.pack(documents)
+        retrieved_at = time.perf_counter()
+        yield {'type': 'context', 'citations': [self.citation(doc) for doc in documents]}
+        first_token_at = None
+        chunks = []
+        inputs = {'context': context, 'question': question, 'chat_history': history[-self.history_window:]}
+        async for chunk in (self.answer_prompt | self.llm).astream(inputs):
+            first_token_at = first_token_at or time.perf_counter()
+            chunks.append(chunk.content)
+            yield {'type': 'token', 'content': chunk.content}
+        if self.pattern_type == 'conversational':
+            self.get_session_history(session_id).add_user_message(question)
+            self.get_session_history(session_id).add_ai_message(''.join(chunks))
+        now = time.perf_counter()
+        self.last_stream_stats = {
+            'time_to_first_citation': (first_citation_at or retrieved_at) - start,
+            'retrieval_time': retrieved_at - start,
+            'time_to_first_token': (first_token_at or now) - start,
+            'total_time': now - start,
+        }
+        yield {'type': 'done', 'stats': self.last_stream_stats}
+
     def _create_conversational_rag(self):
-        # Implement conversational RAG with memory
-        pass
+        # Chat history -> standalone question -> (reused or fresh) context -> answer.
+        # Invoke with config={'configurable': {'session_id': ...}}.
+        prompt = ChatPromptTemplate.from_messages([
+            ('system', 'Answer the question based on the following context:\n{context}'),
+            ('placeholder', '{chat_history}'),
+            ('human', '{question}'),
+        ])
+        self._answer_prompt = prompt
+        def prepare(inputs: dict, config) -> dict:
+            self.conversation_stats['turns'] += 1
+            session_id = config.get('configurable', {}).get('session_id', 'default')
+            standalone = self.condense_question(inputs['question'], inputs.get('chat_history', []))
+            documents = self.retrieve_for_session(standalone, session_id)
+            return {
+                'context': self.context_packer.pack(documents),
+                'chat_history': inputs.get('chat_history', [])[-self.history_window:],
+                'question': inputs['question'],
+            }
+        return RunnableWithMessageHistory(
+            RunnableLambda(prepare) | prompt | self.llm,
+            self.get_session_history,
+            input_messages_key='question',
+            history_messages_key='chat_history',
+        )
+
+def benchmark_incremental_indexing(files: int = 2000, changed_fraction: float = 0.01):
+    # Full build, then a refresh with changed_fraction of files edited, one deleted and
+    # one added; reports embedding calls and wall time relative to the full build
+    from fake_models import FakeEmbeddings
+    with tempfile.TemporaryDirectory() as root, tempfile.TemporaryDirectory() as store_dir:
+        corpus = os.path.join(root, 'corpus')
+        loading.create_synthetic_corpus(corpus, files)
+        embeddings = FakeEmbeddings(delay=0.01)
+        rag = RAGArchitecture(persist_directory=store_dir, embeddings=embeddings)
+        full = rag.ingest(corpus, max_workers=1)
+        full_texts = embeddings.texts_embedded
+        print(f'Full build: {full}')
+
+        paths = sorted(loading.iter_files(corpus))
+        step = max(1, int(1 / changed_fraction))
+        for i, path in enumerate(paths[::step]):
+            with open(path, 'a') as f:
+                if path.endswith('.jsonl'):
+                    f.write('\n' + json.dumps({'id': 'new', 'text': f'Revision {i} adds a record.'}))
+                else:
+                    f.write(f' Revision {i} adds a new closing paragraph.')
+        os.remove(paths[1])
+        shutil.copy(paths[2], os.path.join(corpus, 'copied.txt'))
+
+        embeddings.texts_embedded = 0
+        rag = RAGArchitecture(persist_directory=store_dir, embeddings=embeddings)
+        refresh = rag.ingest(corpus, max_workers=1)
+        print(f'Refresh: {refresh}')
+        print(f'Refresh cost: {embeddings.texts_embedded / full_texts:.1%} of full-build embeddings, '
+              f"{refresh['seconds'] / full['seconds']:.1%} of full-build time")
+        # The store and the manifest must agree on every vector ID
+        manifest = IncrementalIndexer(rag.vectorstore, os.path.join(store_dir, 'manifest.json')).manifest
+        manifest_ids = {doc_id for entry in manifest.values() for doc_id in entry['chunks']}
+        assert manifest_ids == set(rag.vectorstore.ids) == set(rag.keyword_index._numbers)
+
+def benchmark_hybrid_retrieval(documents: int = 20000, queries: int = 200, embedding_delay: float = 0.02):
+    # Hit rate for exact error-code queries, and latency of each leg vs. the fused
+    # retriever. embedding_delay stands in for the embedding API round trip.
+    from fake_models import FakeEmbeddings
+    import random
+    rng = random.Random(0)
+    topics = ['connection pool exhausted', 'token limit exceeded', 'rate limit reached',
+              'invalid api key', 'vector index corrupted', 'timeout waiting for model']
+    texts = [
+        f'Error ERR-{i:05d} in service {rng.choice(topics)}. Retry after checking {rng.choice(topics)}.'
+        for i in range(documents)
+    ]
+    rag = RAGArchitecture(pattern_type='advanced', embeddings=FakeEmbeddings(delay=embedding_delay),
+                          search_kwargs={'k': 4})
+    rag.add_documents([Document(page_content=text) for text in texts])
+    targets = rng.sample(range(documents), queries)
+    questions = [f'What does ERR-{i:05d} mean?' for i in targets]
+    legs = {
+        'dense': rag.vectorstore.as_retriever(search_kwargs={'k': 4}).invoke,
+        'sparse': lambda question: rag.keyword_search(question, 4),
+        'hybrid': rag.hybrid_retriever.invoke,
+    }
+    for name, retrieve in legs.items():
+        hits = 0
+        start = time.perf_counter()
+        for target, question in zip(targets, questions):
+            hits += any(doc.page_content == texts[target] for doc in retrieve(question))
+        elapsed = (time.perf_counter() - start) / queries
+        print(f'{name:>6}: hit@4 {hits / queries:.2f}, {elapsed * 1000:.1f} ms/query')
+
+def benchmark_conversational_rag(sessions: int = 50):
+    # Scripted multi-turn sessions with clarifying follow-ups. The stand-in condenser
+    # resolves 'it' to the last error code mentioned, like a real rewrite would; the
+    # last turn asks the first question again and reuses its retrieval, and with
+    # semantic reuse the reworded follow-ups ('... exactly?') reuse theirs too. The
+    # script is then replayed in fresh sessions (e.g. users retrying the same
+    # conversation), which hits the rewrite cache.
+    from fake_models import FakeChatModel, FakeEmbeddings
+    from langchain_core.messages import AIMessage
+
+    def condense(prompt_value):
+        messages = prompt_value.to_messages()
+        codes = re.findall(r'ERR-\d+', ' '.join(str(message.content) for message in messages[1:-1]))
+        question = messages[-1].content
+        return AIMessage(content=question.replace(' it', f' {codes[-1]}') if codes else question)
+
+    embeddings = FakeEmbeddings()
+    script = ['What does ERR-{code} mean?', 'What does it mean exactly?', 'Why do I get it?',
+              'Why do I get it again?', 'How do I fix it?', 'How do I fix it quickly?', 'What does it mean?']
+    # Hashed word features score paraphrases lower (~0.9) than a trained embedding model
+    # would, so the semantic run uses a looser threshold than the 0.95 default
+    for reuse, reuse_kwargs in (('exact', {}), ('semantic', {'semantic_reuse': True, 'reuse_threshold': 0.9})):
+        rag = RAGArchitecture(pattern_type='conversational', embeddings=embeddings,
+                              llm=FakeChatModel(response='See the runbook.', delay=0.01),
+                              condense_llm=RunnableLambda(condense), history_window=2 * len(script),
+                              reuse_window=len(script), **reuse_kwargs)
+        rag.add_documents([Document(page_content=f'Error ERR-{i:04d}: restart worker pool {i % 7}.') for i in range(2000)])
+        for replay in ('first pass', 'replay'):
+            embeddings.calls = 0
+            rag.conversation_stats = dict.fromkeys(rag.conversation_stats, 0)
+            start = time.perf_counter()
+            for session in range(sessions):
+                config = {'configurable': {'session_id': f'{replay}-{session}'}}
+                for turn in script:
+                    rag.chain.invoke({'question': turn.format(code=f'{session:04d}')}, config=config)
+            stats = rag.conversation_stats
+            print(f"{reuse} reuse, {replay}: {stats['turns']} turns in {time.perf_counter() - start:.2f}s, "
+                  f"{stats['retrievals']} retrievals ({embeddings.calls} embedding calls), "
+                  f"{stats['retrieval_reuses']} reused; {stats['rewrites']} rewrites, "
+                  f"{stats['rewrite_cache_hits']} rewrite cache hits")
+
+def benchmark_context_packing(articles: int = 300, queries: int = 200, k: int = 8):
+    # Overlapping chunks plus mirrored copies of a third of the articles, as happens
+    # with syndicated docs. Compares prompt context tokens for the plain join and
+    # the packer, and checks the passage answering the query survives packing.
+    from fake_models import FakeEmbeddings
+    import random
+    rng = random.Random(0)
+    vocabulary = ['index', 'vector', 'latency', 'token', 'cache', 'batch', 'shard', 'replica',
+                  'prompt', 'chain', 'memory', 'retriever', 'chunk', 'model', 'stream', 'queue']
+    def sentence():
+        return ' '.join(rng.choice(vocabulary) for _ in range(12)).capitalize() + '. '
+    documents, facts = [], []
+    for i in range(articles):
+        fact = f'Fact {i}: the {rng.choice(vocabulary)} limit for deployment D{i} is {rng.randint(1, 999)}. '
+        facts.append(fact)
+        body = ''.join(sentence() for _ in range(10)) + fact + ''.join(sentence() for _ in range(10))
+        documents.append(Document(page_content=body, metadata={'source': f'articles/{i}.md'}))
+        if i % 3 == 0:
+            documents.append(Document(page_content=body, metadata={'source': f'mirror/{i}.md'}))
+    chunks = list(chunking.RecursiveChunker(chunk_size=400, chunk_overlap=120).chunk_documents(documents))
+    rag = RAGArchitecture(embeddings=FakeEmbeddings(), search_kwargs={'k': k})
+    rag.add_documents(chunks)
+    packer = ContextPacker(max_tokens=1000)
+    plain_tokens = packed_tokens = plain_found = packed_found = 0
+    totals = {'merged': 0, 'duplicates': 0, 'over_budget': 0}
+    start = time.perf_counter()
+    for i in rng.sample(range(articles), queries):
+        retrieved = rag.retriever.invoke(f'What is the limit for deployment D{i}?')
+        plain = '\n\n'.join(doc.page_content for doc in retrieved)
+        packed = packer.pack(retrieved)
+        plain_tokens += packer.token_counter(plain)
+        packed_tokens += packer.last_stats['tokens']
+        plain_found += facts[i] in plain
+        packed_found += facts[i] in packed
+        for key in totals:
+            totals[key] += packer.last_stats[key]
+    elapsed = (time.perf_counter() - start) / queries
+    print(f'plain join: {plain_tokens / queries:.0f} tokens/prompt, answer present {plain_found / queries:.0%}')
+    print(f'packed:     {packed_tokens / queries:.0f} tokens/prompt, answer present {packed_found / queries:.0%} '
+          f'({1 - packed_tokens / plain_tokens:.0%} fewer tokens)')
+    averages = ', '.join(f'{key} {value / queries:.1f}' for key, value in totals.items())
+    print(f'per query: {averages}; {elapsed * 1000:.1f} ms retrieval + packing')
+
+def benchmark_batch_query(questions: int = 5000, duplicate_rate: float = 0.3, max_concurrency: int = 64):
+    # batch_query vs. chain.batch (one embedding call and one search per question)
+    # with the same generation concurrency. The fake embedding API charges 20 ms a
+    # call and the fake LLM 50 ms, so retrieval overhead shows up directly.
+    from fake_models import FakeChatModel, FakeEmbeddings
+    import random
+    rng = random.Random(0)
+    embeddings = FakeEmbeddings(delay=0.02)
+    rag = RAGArchitecture(embeddings=embeddings, llm=FakeChatModel(response='42', delay=0.05))
+    rag.add_documents([Document(page_content=f'Service S{i} runs on cluster C{i % 40} with {i % 9} replicas.')
+                       for i in range(20000)])
+    distinct = [f'Which cluster runs service S{i}?' for i in rng.sample(range(20000), questions)]
+    batch = [rng.choice(distinct[:len(distinct) // 2]) if rng.random() < duplicate_rate else question
+             for question in distinct]
+    embeddings.calls = 0
+    start = time.perf_counter()
+    answers = rag.batch_query(batch, max_concurrency=max_concurrency)
+    elapsed = time.perf_counter() - start
+    stats = rag.last_batch_stats
+    print(f"batch_query: {len(batch) / elapsed:.0f} questions/s, {stats['unique']} unique, "
+          f"{embeddings.calls} embedding calls, retrieval {stats['retrieval_seconds']:.2f}s, "
+          f"generation {stats['generation_seconds']:.2f}s")
+    assert all(answer.content == '42' for answer in answers)
+    sample = batch[:1000]
+    embeddings.calls = 0
+    start = time.perf_counter()
+    rag.chain.batch(sample, config={'max_concurrency': max_concurrency})
+    elapsed = time.perf_counter() - start
+    print(f'chain.batch: {len(sample) / elapsed:.0f} questions/s, {embeddings.calls} embedding calls '
+          f'(first {len(sample)} questions)')
+
+def benchmark_reranking(documents: int = 20000, queries: int = 200, top_n: int = 30):
+    # Answer hit rate and packed prompt tokens for dense top-k at several k vs. a
+    # small k after reranking top_n candidates; then the same queries again, and
+    # as a second page, to show the score cache
+    from fake_models import FakeEmbeddings
+    import random
+    rng = random.Random(0)
+    topics = ['connection pool exhausted', 'token limit exceeded', 'rate limit reached',
+              'invalid api key', 'vector index corrupted', 'timeout waiting for model']
+    texts = [f'Error ERR-{i:05d} in service {rng.choice(topics)}. Retry after checking {rng.choice(topics)}.'
+             for i in range(documents)]
+    corpus = [Document(page_content=text) for text in texts]
+    targets = rng.sample(range(documents), queries)
+    questions = [f'What does ERR-{i:05d} mean?' for i in targets]
+    store = vector_embeddings.NumpyVectorStore.from_documents(corpus, FakeEmbeddings())
+    settings = [('dense k=2', 2, None), ('dense k=8', 8, None), ('dense k=16', 16, None),
+                (f'rerank top {top_n} -> k=2', 2, Reranker(top_n=top_n))]
+    for name, k, reranker in settings:
+        fetch_k = top_n if reranker else k
+        rag = RAGArchitecture(retriever=store.as_retriever(search_kwargs={'k': fetch_k}),
+                              search_kwargs={'k': k}, reranker=reranker)
+        hits = tokens = 0
+        start = time.perf_counter()
+        for target, question in zip(targets, questions):
+            selected = rag.select_documents(question, rag.retriever.invoke(question))
+            hits += any(doc.page_content == texts[target] for doc in selected)
+            rag.context_packer.pack(selected)
+            tokens += rag.context_packer.last_stats['tokens']
+        elapsed = (time.perf_counter() - start) / queries
+        print(f'{name:>22}: hit {hits / queries:.2f}, {tokens / queries:.0f} context tokens, {elapsed * 1000:.1f} ms/query')
+    print(f'rerank stage: {reranker.latency_report()}')
+    for question in questions:
+        reranker.rerank(question, store.similarity_search(question, top_n), k=2)
+        reranker.rerank(question, store.similarity_search(question, top_n), k=2, offset=2)
+    print(f'after repeat + page 2: {reranker.latency_report()}')
+
+def demo_streaming_rag():
+    # Blocking chain vs. astream on the advanced pattern. Embedding calls take 80 ms,
+    # the model 300 ms to first token and 20 ms per token after that.
+    from fake_models import FakeChatModel, FakeEmbeddings
+    answer = ' '.join(['Restart the worker pool and raise the connection limit.'] * 5)
+    rag = RAGArchitecture(pattern_type='advanced', embeddings=FakeEmbeddings(delay=0.08),
+                          llm=FakeChatModel(response=answer, delay=0.3, token_delay=0.02))
+    rag.add_documents([Document(page_content=f'Error ERR-{i:04d}: restart worker pool {i % 7}.',
+                                metadata={'source': f'runbooks/{i % 50}.md'}) for i in range(5000)])
+    question = 'How do I fix ERR-0042?'
+
+    async def run():
+        start = time.perf_counter()
+        await rag.chain.ainvoke(question)
+        print(f'chain.ainvoke: first byte after {time.perf_counter() - start:.2f}s (whole answer)')
+        start = time.perf_counter()
+        async for event in rag.astream(question):
+            elapsed = time.perf_counter() - start
+            if event['type'] == 'citations':
+                print(f"{elapsed:.2f}s {event['source']} citations: {[c.get('source') for c in event['citations'][:3]]}")
+            elif event['type'] == 'context':
+                print(f"{elapsed:.2f}s context: {len(event['citations'])} passages")
+            elif event['type'] == 'done':
+                print(f"{elapsed:.2f}s done: " + ', '.join(f'{k} {v:.2f}s' for k, v in event['stats'].items()))
+
+    asyncio.run(run())
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'stream':
+        demo_streaming_rag()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'rerank':
+        benchmark_reranking()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        benchmark_batch_query()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'pack':
+        benchmark_context_packing()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'hybrid':
+        benchmark_hybrid_retrieval()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'conversational':
+        benchmark_conversational_rag()
+    elif len(sys.argv) > 2 and sys.argv[1] == 'ingest':
+        # python 3-1_rag_patterns.py ingest <corpus dir> [store dir]
+        rag = RAGArchitecture(persist_directory=sys.argv[3] if len(sys.argv) > 3 else '.rag_store')
+        print(rag.ingest(sys.argv[2]))
+    else:
+        benchmark_incremental_indexing()
@@ -0,0 +1,191 @@
+from abc import ABC, abstractmethod
+from langchain_core.documents import Document
+from typing import Iterable, Iterator, List, Tuple
+import importlib
+import re
+import sys
+import time
+import warnings
+
+# Chunkers work on (start, end) character spans into the original text and slice
+# each chunk out exactly once, so overlap never copies or re-tokenizes text and the
+# offsets in chunk metadata always point back into the source document.
+
+def _merge_spans(pieces: List[Tuple[int, int]], chunk_size: int, chunk_overlap: int) -> Iterator[Tuple[int, int]]:
+    # Greedily pack contiguous pieces into chunks of at most chunk_size characters.
+    # Each new chunk starts with the trailing pieces of the previous one that fit in
+    # chunk_overlap, shrunk if needed so the next piece still fits; every chunk ends
+    # past the previous one. Two pointers over the piece list, so linear in the piece count.
+    i = 0
+    n = len(pieces)
+    while i < n:
+        start = pieces[i][0]
+        j = i
+        while j + 1 < n and pieces[j + 1][1] - start <= chunk_size:
+            j += 1
+        yield start, pieces[j][1]
+        if j + 1 >= n:
+            return
+        k = j + 1
+        while k - 1 > i and pieces[j][1] - pieces[k - 1][0] <= chunk_overlap:
+            k -= 1
+        while k <= j and pieces[j + 1][1] - pieces[k][0] > chunk_size:
+            k += 1
+        i = k
+
+def _fixed_spans(start: int, end: int, chunk_size: int, chunk_overlap: int) -> Iterator[Tuple[int, int]]:
+    step = max(1, chunk_size - chunk_overlap)
+    position = start
+    while position < end:
+        yield position, min(position + chunk_size, end)
+        if position + chunk_size >= end:
+            return
+        position += step
+
+class Chunker(ABC):
+    def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200):
+        if chunk_overlap >= chunk_size:
+            raise ValueError(f'chunk_overlap ({chunk_overlap}) must be smaller than chunk_size ({chunk_size})')
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+
+    @abstractmethod
+    def spans(self, text: str) -> Iterator[Tuple[int, int]]:
+        ...
+
+    def chunk_document(self, document: Document) -> Iterator[Document]:
+        text = document.page_content
+        for index, (start, end) in enumerate(self.spans(text)):
+            yield Document(
+                page_content=text[start:end],
+                metadata={**document.metadata, 'start_index': start, 'end_index': end, 'chunk_index': index},
+            )
+
+    def chunk_documents(self, documents: Iterable[Document]) -> Iterator[Document]:
+        # Lazy: pulls one document at a time from the loader stream
+        for document in documents:
+            yield from self.chunk_document(document)
+
+class FixedSizeChunker(Chunker):
+    def spans(self, text: str) -> Iterator[Tuple[int, int]]:
+        return _fixed_spans(0, len(text), self.chunk_size, self.chunk_overlap)
+
+class RecursiveChunker(Chunker):
+    # Splits on the coarsest separator first and only recurses into pieces that are
+    # still too long; separators stay attached to the end of the preceding piece
+    def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200, separators: list = None):
+        super().__init__(chunk_size, chunk_overlap)
+        self.separators = separators or ['\n\n', '\n', '. ', ' ']
+
+    def _pieces(self, text: str, start: int, end: int, level: int, out: list):
+        if end - start <= self.chunk_size:
+            out.append((start, end))
+            return
+        if level >= len(self.separators):
+            out.extend(_fixed_spans(start, end, self.chunk_size, 0))
+            return
+        separator = self.separators[level]
+        position = start
+        while position < end:
+            found = text.find(separator, position, end)
+            piece_end = end if found == -1 else found + len(separator)
+            self._pieces(text, position, piece_end, level + 1, out)
+            position = piece_end
+
+    def spans(self, text: str) -> Iterator[Tuple[int, int]]:
+        pieces = []
+        self._pieces(text, 0, len(text), 0, pieces)
+        return _merge_spans(pieces, self.chunk_size, self.chunk_overlap)
+
+class SentenceChunker(Chunker):
+    # Packs whole sentences; a sentence longer than chunk_size is split by size
+    SENTENCE_PATTERN = re.compile(r'[^.!?\n]*(?:[.!?]+|\n+|$)\s*')
+
+    def spans(self, text: str) -> Iterator[Tuple[int, int]]:
+        pieces = []
+        for match in self.SENTENCE_PATTERN.finditer(text):
+            start, end = match.span()
+            if start == end:
+                continue
+            if end - start > self.chunk_size:
+                pieces.extend(_fixed_spans(start, end, self.chunk_size, 0))
+            else:
+                pieces.append((start, end))
+        return _merge_spans(pieces, self.chunk_size, self.chunk_overlap)
+
+_WORD_PATTERN = re.compile(r'\S+\s*|\s+')
+
+def regex_token_offsets(text: str) -> List[int]:
+    # Offline approximation of a tokenizer: one token per word
+    return [match.start() for match in _WORD_PATTERN.finditer(text)]
+
+def tiktoken_token_offsets(encoding_name: str = 'cl100k_base'):
+    import tiktoken
+    encoding = tiktoken.get_encoding(encoding_name)
+    def offsets(text: str) -> List[int]:
+        _, token_offsets = encoding.decode_with_offsets(encoding.encode(text, disallowed_special=()))
+        return token_offsets
+    return offsets
+
+class TokenChunker(Chunker):
+    # chunk_size and chunk_overlap are in tokens. Each document is tokenized once;
+    # chunk boundaries are token offsets, so overlap regions are never re-tokenized.
+    def __init__(self, chunk_size: int = 256, chunk_overlap: int = 32, token_offsets=None,
+                 encoding_name: str = 'cl100k_base'):
+        super().__init__(chunk_size, chunk_overlap)
+        if token_offsets is None:
+            try:
+                token_offsets = tiktoken_token_offsets(encoding_name)
+            except Exception as e:
+                warnings.warn(f'tiktoken unavailable ({e}); falling back to word tokens')
+                token_offsets = regex_token_offsets
+        self.token_offsets = token_offsets
+
+    def spans(self, text: str) -> Iterator[Tuple[int, int]]:
+        offsets = self.token_offsets(text)
+        for first, last in _fixed_spans(0, len(offsets), self.chunk_size, self.chunk_overlap):
+            yield offsets[first], offsets[last] if last < len(offsets) else len(text)
+
+CHUNKERS = {
+    'fixed': FixedSizeChunker,
+    'recursive': RecursiveChunker,
+    'sentence': SentenceChunker,
+    'token': TokenChunker,
+}
+
+def create_chunker(strategy: str, **kwargs) -> Chunker:
+    if strategy not in CHUNKERS:
+        raise ValueError(f'Unknown chunking strategy: {strategy}')
+    return CHUNKERS[strategy](**kwargs)
+
+def benchmark_chunkers(megabytes: int = 20, documents: int = 200):
+    # Single-process throughput in MB/s for each strategy over a synthetic stream
+    sentence = 'Retrieval quality depends on chunk boundaries. Does this sentence end here? Yes!\n'
+    paragraph = sentence * 30 + '\n'
+    body = paragraph * max(1, megabytes * 2 ** 20 // (len(paragraph) * documents))
+    corpus = [Document(page_content=body, metadata={'source': f'doc_{i}'}) for i in range(documents)]
+    total_mb = len(body) * documents / 2 ** 20
+    settings = {
+        'fixed': {'chunk_size': 1000, 'chunk_overlap': 200},
+        'recursive': {'chunk_size': 1000, 'chunk_overlap': 200},
+        'sentence': {'chunk_size': 1000, 'chunk_overlap': 200},
+        'token': {'chunk_size': 256, 'chunk_overlap': 32},
+    }
+    for strategy, kwargs in settings.items():
+        chunker = create_chunker(strategy, **kwargs)
+        start = time.perf_counter()
+        chunks = sum(1 for _ in chunker.chunk_documents(corpus))
+        elapsed = time.perf_counter() - start
+        print(f'{strategy:>9}: {total_mb / elapsed:7.1f} MB/s per core, {chunks} chunks')
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        # Chunk a directory streamed through the 3-2 loader
+        loading = importlib.import_module('3-2_document_loading_and_preprocessing')
+        chunker = RecursiveChunker()
+        chunks = 0
+        for chunk in chunker.chunk_documents(loading.ParallelDirectoryLoader(sys.argv[1]).lazy_load()):
+            chunks += 1
+        print(f'{chunks} chunks')
+    else:
+        benchmark_chunkers()
@@ -0,0 +1,675 @@
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from typing import Any, Iterable, List, Optional, Tuple
+import json
+import os
+import sys
+import time
+import uuid
+import numpy as np
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+# Storage dtypes for the index. float16 halves memory; int8 quarters it by storing
+# round(v * 127) of the unit-normalized vectors. Search always computes in float32.
+SUPPORTED_DTYPES = ('float32', 'float16', 'int8')
+INT8_SCALE = 127.0
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+def save_array(folder: str, name: str, array: np.ndarray):
+    # Write then rename, so a store memory-mapped from this folder can be saved back
+    # over itself without truncating the file it is reading from
+    path = os.path.join(folder, name)
+    with open(path + '.tmp', 'wb') as f:
+        np.save(f, array)
+    os.replace(path + '.tmp', path)
+
+class VectorIndex:
+    # Contiguous row-major matrix of unit vectors with amortized O(1) appends.
+    # Top-k cosine search answers a whole batch of queries with one matrix multiply
+    # and np.argpartition instead of a Python loop per query or per vector.
+    def __init__(self, dimension: int, dtype: str = 'float32', block_size: int = 65536):
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f'Unsupported dtype: {dtype}')
+        self.dimension = dimension
+        self.dtype = dtype
+        # Quantized rows are upcast to float32 this many at a time during search
+        self.block_size = block_size
+        self._matrix = np.empty((0, dimension), dtype=dtype)
+        self.count = 0
+
+    @property
+    def matrix(self) -> np.ndarray:
+        return self._matrix[:self.count]
+
+    def _encode(self, vectors: np.ndarray) -> np.ndarray:
+        vectors = normalize(vectors)
+        if self.dtype == 'int8':
+            return np.clip(np.round(vectors * INT8_SCALE), -127, 127).astype(np.int8)
+        return vectors.astype(self.dtype)
+
+    def add(self, vectors) -> range:
+        encoded = self._encode(np.atleast_2d(vectors))
+        needed = self.count + len(encoded)
+        if needed > len(self._matrix) or not self._matrix.flags.writeable:
+            # Grow geometrically; also copies a memory-mapped index into RAM on first write
+            capacity = max(needed, 2 * len(self._matrix), 1024)
+            grown = np.empty((capacity, self.dimension), dtype=self.dtype)
+            grown[:self.count] = self._matrix[:self.count]
+            self._matrix = grown
+        self._matrix[self.count:needed] = encoded
+        positions = range(self.count, needed)
+        self.count = needed
+        return positions
+
+    def remove(self, positions: Iterable[int]):
+        keep = np.ones(self.count, dtype=bool)
+        keep[list(positions)] = False
+        remaining = self.matrix[keep]
+        self._matrix = np.ascontiguousarray(remaining)
+        self.count = len(remaining)
+
+    def _scores(self, queries: np.ndarray) -> np.ndarray:
+        if self.dtype == 'float32':
+            return queries @ self.matrix.T
+        scores = np.empty((len(queries), self.count), dtype=np.float32)
+        for start in range(0, self.count, self.block_size):
+            block = self.matrix[start:start + self.block_size].astype(np.float32)
+            scores[:, start:start + len(block)] = queries @ block.T
+        if self.dtype == 'int8':
+            scores /= INT8_SCALE
+        return scores
+
+    def search(self, queries, k: int = 4, query_batch_size: int = 1024) -> Tuple[np.ndarray, np.ndarray]:
+        # Returns (scores, positions), each shaped (n_queries, k), best first
+        queries = normalize(np.atleast_2d(queries))
+        k = min(k, self.count)
+        if k == 0:
+            empty = np.empty((len(queries), 0))
+            return empty.astype(np.float32), empty.astype(np.int64)
+        all_scores = []
+        all_positions = []
+        # Query batches bound the size of the (queries x rows) score matrix
+        for start in range(0, len(queries), query_batch_size):
+            scores = self._scores(queries[start:start + query_batch_size])
+            if k < self.count:
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            else:
+                top = np.broadcast_to(np.arange(self.count), scores.shape).copy()
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1)
+            all_positions.append(np.take_along_axis(top, order, axis=1))
+            all_scores.append(np.take_along_axis(top_scores, order, axis=1))
+        return np.vstack(all_scores), np.vstack(all_positions)
+
+    def save(self, folder: str):
+        save_array(folder, 'vectors.npy', self.matrix)
+
+    @classmethod
+    def load(cls, folder: str, mmap: bool = True) -> 'VectorIndex':
+        # mmap=True maps the matrix read-only from disk, so opening is O(1) in index size
+        matrix = np.load(os.path.join(folder, 'vectors.npy'), mmap_mode='r' if mmap else None)
+        index = cls(matrix.shape[1], dtype=str(matrix.dtype))
+        index._matrix = matrix
+        index.count = len(matrix)
+        return index
+
+def spherical_kmeans(vectors: np.ndarray, n_clusters: int, iterations: int = 10,
+                     sample_size: int = None, seed: int = 0) -> np.ndarray:
+    # k-means on unit vectors using dot-product assignment; trains on a sample
+    rng = np.random.default_rng(seed)
+    sample_size = sample_size or n_clusters * 64
+    if len(vectors) > sample_size:
+        vectors = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].astype(np.float32)
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        empty = ~sums.any(axis=1)
+        # Re-seed empty clusters from random points so every list gets used
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        centroids = normalize(sums)
+    return centroids
+
+class IVFIndex:
+    # Pure-NumPy inverted-file index: vectors are bucketed by nearest centroid and
+    # a query only scans the nprobe closest buckets. Higher nprobe = better recall,
+    # higher latency. Until train_size vectors have arrived they sit in an exact
+    # pending index; centroids are then trained on them and later adds are assigned
+    # to the existing centroids. An index that grows to retrain_factor times the size
+    # it was trained at is retrained, so an early (small) training doesn't stick.
+    def __init__(self, dimension: int, n_lists: int = None, nprobe: int = 8, dtype: str = 'float32',
+                 train_size: int = None, retrain_factor: float = 4.0):
+        self.dimension = dimension
+        # requested_lists is the setting; n_lists is what the current training uses
+        self.requested_lists = n_lists
+        self.n_lists = n_lists
+        self.nprobe = nprobe
+        self.retrain_factor = retrain_factor
+        self.trained_size = 0
+        self.dtype = dtype
+        # ~39 points per list is the usual k-means minimum
+        self.train_size = train_size or (39 * n_lists if n_lists else 10000)
+        self.pending = VectorIndex(dimension, dtype)
+        self.centroids = None
+        self.lists = []
+        self.list_positions = []
+        self.count = 0
+
+    def train(self):
+        if not self.pending.count:
+            raise ValueError('Cannot train an IVF index without vectors')
+        vectors = self.pending.matrix.astype(np.float32)
+        if self.dtype == 'int8':
+            vectors = vectors / INT8_SCALE
+        self.n_lists = self._target_lists(len(vectors))
+        self.trained_size = len(vectors)
+        self.centroids = spherical_kmeans(vectors, self.n_lists)
+        self.lists = [VectorIndex(self.dimension, self.dtype) for _ in range(self.n_lists)]
+        self.list_positions = [np.empty(0, dtype=np.int64) for _ in range(self.n_lists)]
+        self.pending = None
+        self.count = 0
+        self._assign(vectors)
+
+    def _target_lists(self, count: int) -> int:
+        return min(self.requested_lists or max(1, int(4 * np.sqrt(count))), count)
+
+    def _needs_retrain(self) -> bool:
+        return (self.count >= self.retrain_factor * self.trained_size
+                and self._target_lists(self.count) > self.n_lists)
+
+    def retrain(self):
+        # Gather every row back into position order and train again from scratch
+        matrix = np.empty((self.count, self.dimension), dtype=self.dtype)
+        for list_index, list_positions in zip(self.lists, self.list_positions):
+            matrix[list_positions] = list_index.matrix
+        self.pending = VectorIndex(self.dimension, self.dtype)
+        self.pending._matrix = matrix
+        self.pending.count = self.count
+        self.centroids = None
+        self.train()
+
+    def add(self, vectors) -> range:
+        vectors = normalize(np.atleast_2d(vectors))
+        if self.centroids is None:
+            positions = self.pending.add(vectors)
+            self.count = self.pending.count
+            if self.count >= self.train_size:
+                self.train()
+            return positions
+        positions = self._assign(vectors)
+        if self._needs_retrain():
+            self.retrain()
+        return positions
+
+    def _assign(self, vectors: np.ndarray) -> range:
+        positions = np.arange(self.count, self.count + len(vectors))
+        assignment = np.argmax(vectors @ self.centroids.T, axis=1)
+        order = np.argsort(assignment, kind='stable')
+        bounds = np.searchsorted(assignment[order], np.arange(self.n_lists + 1))
+        for list_id in range(self.n_lists):
+            members = order[bounds[list_id]:bounds[list_id + 1]]
+            if len(members):
+                self.lists[list_id].add(vectors[members])
+                self.list_positions[list_id] = np.concatenate([self.list_positions[list_id], positions[members]])
+        self.count += len(vectors)
+        return range(positions[0], positions[-1] + 1) if len(positions) else range(self.count, self.count)
+
+    def remove(self, positions: Iterable[int]):
+        # Drop rows and renumber the survivors so positions stay dense and ordered
+        removed = np.array(sorted(positions), dtype=np.int64)
+        if self.centroids is None:
+            self.pending.remove(removed)
+            self.count = self.pending.count
+            return
+        for list_id, list_positions in enumerate(self.list_positions):
+            drop = np.isin(list_positions, removed)
+            if drop.any():
+                self.lists[list_id].remove(np.flatnonzero(drop))
+                list_positions = list_positions[~drop]
+            self.list_positions[list_id] = list_positions - np.searchsorted(removed, list_positions)
+        self.count -= len(removed)
+
+    def search(self, queries, k: int = 4) -> Tuple[np.ndarray, np.ndarray]:
+        queries = normalize(np.atleast_2d(queries))
+        nprobe = min(self.nprobe, self.n_lists or 1)
+        all_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        all_positions = np.full((len(queries), k), -1, dtype=np.int64)
+        if self.centroids is None:
+            scores, positions = self.pending.search(queries, k)
+            all_scores[:, :scores.shape[1]] = scores
+            all_positions[:, :positions.shape[1]] = positions
+            return all_scores, all_positions
+        probes = np.argpartition(-(queries @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+        for row, (query, lists) in enumerate(zip(queries, probes)):
+            scores = []
+            positions = []
+            for list_id in lists:
+                list_index = self.lists[list_id]
+                if list_index.count:
+                    scores.append(list_index._scores(query[None, :])[0])
+                    positions.append(self.list_positions[list_id])
+            if not scores:
+                continue
+            scores = np.concatenate(scores)
+            positions = np.concatenate(positions)
+            top = np.argpartition(-scores, min(k, len(scores)) - 1)[:k] if len(scores) > k else np.arange(len(scores))
+            top = top[np.argsort(-scores[top])]
+            all_scores[row, :len(top)] = scores[top]
+            all_positions[row, :len(top)] = positions[top]
+        return all_scores, all_positions
+
+    def save(self, folder: str):
+        # An untrained index is saved as its pending vectors and trains once it has
+        # train_size of them, rather than being trained early on whatever exists
+        settings = {'nprobe': self.nprobe, 'count': self.count, 'dtype': self.dtype,
+                    'n_lists': self.requested_lists, 'train_size': self.train_size,
+                    'retrain_factor': self.retrain_factor, 'trained_size': self.trained_size,
+                    'trained': self.centroids is not None}
+        if self.centroids is None:
+            self.pending.save(folder)
+        else:
+            sizes = np.array([index.count for index in self.lists], dtype=np.int64)
+            save_array(folder, 'ivf_centroids.npy', self.centroids)
+            save_array(folder, 'ivf_vectors.npy', np.concatenate([index.matrix for index in self.lists]))
+            save_array(folder, 'ivf_positions.npy', np.concatenate(self.list_positions))
+            save_array(folder, 'ivf_offsets.npy', np.concatenate([[0], np.cumsum(sizes)]))
+        with open(os.path.join(folder, 'ivf.json'), 'w') as f:
+            json.dump(settings, f)
+
+    @classmethod
+    def load(cls, folder: str, mmap: bool = True) -> 'IVFIndex':
+        mode = 'r' if mmap else None
+        with open(os.path.join(folder, 'ivf.json')) as f:
+            settings = json.load(f)
+        trained = settings.pop('trained', True)
+        count = settings.pop('count')
+        trained_size = settings.pop('trained_size', 0)
+        if not trained:
+            pending = VectorIndex.load(folder, mmap=mmap)
+            index = cls(pending.dimension, **settings)
+            index.pending = pending
+            index.count = count
+            return index
+        centroids = np.load(os.path.join(folder, 'ivf_centroids.npy'))
+        vectors = np.load(os.path.join(folder, 'ivf_vectors.npy'), mmap_mode=mode)
+        positions = np.load(os.path.join(folder, 'ivf_positions.npy'))
+        offsets = np.load(os.path.join(folder, 'ivf_offsets.npy'))
+        index = cls(centroids.shape[1], **settings)
+        index.n_lists = len(centroids)
+        index.pending = None
+        index.trained_size = trained_size
+        index.centroids = centroids
+        index.count = count
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            list_index = VectorIndex(index.dimension, index.dtype)
+            list_index._matrix = vectors[start:end]
+            list_index.count = int(end - start)
+            index.lists.append(list_index)
+            index.list_positions.append(positions[start:end])
+        return index
+
+class FaissIndex:
+    # FAISS HNSW or IVF over inner product on unit vectors (i.e. cosine).
+    # Knobs: ef_search for HNSW, nprobe for IVF. Like IVFIndex, IVF serves exact
+    # search from a pending index until train_size vectors have arrived, and is
+    # retrained once it grows to retrain_factor times its trained size.
+    def __init__(self, dimension: int, kind: str = 'hnsw', hnsw_m: int = 32, ef_construction: int = 200,
+                 ef_search: int = 64, n_lists: int = None, nprobe: int = 8, train_size: int = None,
+                 retrain_factor: float = 4.0, index=None):
+        if faiss is None:
+            raise ImportError('faiss is required for FaissIndex: pip install faiss-cpu')
+        self.dimension = dimension
+        self.kind = kind
+        self.n_lists = n_lists
+        self.nprobe = nprobe
+        self.train_size = train_size or (39 * n_lists if n_lists else 10000)
+        self.retrain_factor = retrain_factor
+        self.trained_size = index.ntotal if index is not None and kind != 'hnsw' else 0
+        self.pending = VectorIndex(dimension) if index is None and kind != 'hnsw' else None
+        if index is None and kind == 'hnsw':
+            index = faiss.IndexHNSWFlat(dimension, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = ef_construction
+        self.index = index
+        self.ef_search = ef_search
+        self.mmap_path = None
+
+    @property
+    def count(self) -> int:
+        return self.index.ntotal if self.index is not None else self.pending.count
+
+    def _apply_search_params(self):
+        if self.kind == 'hnsw':
+            self.index.hnsw.efSearch = self.ef_search
+        else:
+            self.index.nprobe = self.nprobe
+
+    def _writable(self):
+        # Memory-mapped inverted lists are read-only; load a private copy on first write
+        if self.mmap_path:
+            self.index = faiss.read_index(self.mmap_path)
+            self.mmap_path = None
+
+    def train(self):
+        if not self.pending.count:
+            raise ValueError('Cannot train an IVF index without vectors')
+        vectors = np.ascontiguousarray(self.pending.matrix)
+        n_lists = self._target_lists(len(vectors))
+        self.trained_size = len(vectors)
+        quantizer = faiss.IndexFlatIP(self.dimension)
+        index = faiss.IndexIVFFlat(quantizer, self.dimension, n_lists, faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+        index.add(vectors)
+        self.index = index
+        self.pending = None
+
+    def _target_lists(self, count: int) -> int:
+        return min(self.n_lists or max(1, int(4 * np.sqrt(count))), count)
+
+    def retrain(self):
+        self._writable()
+        self.index.make_direct_map()
+        self.pending = VectorIndex(self.dimension)
+        self.pending.add(self.index.reconstruct_n(0, self.count))
+        self.index = None
+        self.train()
+
+    def add(self, vectors) -> range:
+        vectors = np.ascontiguousarray(normalize(np.atleast_2d(vectors)))
+        if self.index is None:
+            positions = self.pending.add(vectors)
+            if self.pending.count >= self.train_size:
+                self.train()
+            return positions
+        self._writable()
+        start = self.count
+        self.index.add(vectors)
+        if (self.kind != 'hnsw' and self.count >= self.retrain_factor * self.trained_size
+                and self._target_lists(self.count) > self.index.nlist):
+            self.retrain()
+        return range(start, self.count)
+
+    def remove(self, positions: Iterable[int]):
+        # HNSW graphs don't support deletion; rebuild from the stored vectors instead
+        if self.index is None:
+            self.pending.remove(positions)
+            return
+        self._writable()
+        if self.kind != 'hnsw':
+            self.index.make_direct_map()
+        keep = np.ones(self.count, dtype=bool)
+        keep[list(positions)] = False
+        vectors = self.index.reconstruct_n(0, self.count)[keep]
+        rebuilt = faiss.clone_index(self.index)
+        rebuilt.reset()
+        rebuilt.add(vectors)
+        self.index = rebuilt
+
+    def search(self, queries, k: int = 4) -> Tuple[np.ndarray, np.ndarray]:
+        queries = np.ascontiguousarray(normalize(np.atleast_2d(queries)))
+        if self.index is None:
+            return self.pending.search(queries, k)
+        self._apply_search_params()
+        return self.index.search(queries, k)
+
+    def save(self, folder: str):
+        # Untrained IVF is saved as its pending vectors, like IVFIndex
+        settings = {'kind': self.kind, 'ef_search': self.ef_search, 'nprobe': self.nprobe,
+                    'n_lists': self.n_lists, 'train_size': self.train_size,
+                    'retrain_factor': self.retrain_factor, 'trained_size': self.trained_size,
+                    'trained': self.index is not None}
+        if self.index is None:
+            self.pending.save(folder)
+        else:
+            path = os.path.join(folder, 'faiss.index')
+            faiss.write_index(self.index, path + '.tmp')
+            os.replace(path + '.tmp', path)
+        with open(os.path.join(folder, 'faiss.json'), 'w') as f:
+            json.dump(settings, f)
+
+    @classmethod
+    def load(cls, folder: str, mmap: bool = True) -> 'FaissIndex':
+        with open(os.path.join(folder, 'faiss.json')) as f:
+            settings = json.load(f)
+        trained_size = settings.pop('trained_size', None)
+        if not settings.pop('trained', True):
+            pending = VectorIndex.load(folder, mmap=mmap)
+            loaded = cls(pending.dimension, **settings)
+            loaded.pending = pending
+            return loaded
+        flags = faiss.IO_FLAG_MMAP if mmap else 0
+        index = faiss.read_index(os.path.join(folder, 'faiss.index'), flags)
+        loaded = cls(index.d, **settings, index=index)
+        if trained_size is not None:
+            loaded.trained_size = trained_size
+        loaded.mmap_path = os.path.join(folder, 'faiss.index') if mmap else None
+        return loaded
+
+# Index backends by name, used by NumpyVectorStore and RAGArchitecture
+INDEX_BACKENDS = {
+    'exact': VectorIndex,
+    'ivf': IVFIndex,
+    'faiss_hnsw': lambda dimension, **kwargs: FaissIndex(dimension, kind='hnsw', **kwargs),
+    'faiss_ivf': lambda dimension, **kwargs: FaissIndex(dimension, kind='ivf', **kwargs),
+}
+INDEX_CLASSES = {'exact': VectorIndex, 'ivf': IVFIndex, 'faiss_hnsw': FaissIndex, 'faiss_ivf': FaissIndex}
+
+class NumpyVectorStore(VectorStore):
+    # LangChain vector store over a VectorIndex (or an ANN backend from INDEX_BACKENDS),
+    # so as_retriever() plugs straight into RAGArchitecture. Documents are embedded in
+    # batches of embedding_batch_size. index_kwargs carry backend knobs such as nprobe.
+    def __init__(self, embedding: Embeddings, dtype: str = 'float32', embedding_batch_size: int = 256,
+                 index_backend: str = 'exact', index_kwargs: dict = None):
+        if index_backend not in INDEX_BACKENDS:
+            raise ValueError(f'Unknown index backend: {index_backend}')
+        self.embedding = embedding
+        self.dtype = dtype
+        self.embedding_batch_size = embedding_batch_size
+        self.index_backend = index_backend
+        self.index_kwargs = dict(index_kwargs or {})
+        if index_backend in ('exact', 'ivf'):
+            self.index_kwargs.setdefault('dtype', dtype)
+        self.index = None
+        self.ids = []
+        self.documents = []
+        self._positions = {}
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+    def add_vectors(self, vectors, documents: List[Document], ids: List[str] = None) -> List[str]:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.index is None:
+            self.index = INDEX_BACKENDS[self.index_backend](vectors.shape[1], **self.index_kwargs)
+        ids = ids or [str(uuid.uuid4()) for _ in documents]
+        for doc_id, position in zip(ids, self.index.add(vectors)):
+            self._positions[doc_id] = position
+        self.ids.extend(ids)
+        self.documents.extend(documents)
+        return ids
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        for start in range(0, len(texts), self.embedding_batch_size):
+            end = start + self.embedding_batch_size
+            vectors = self.embedding.embed_documents(texts[start:end])
+            documents = [
+                Document(page_content=text, metadata=metadata, id=doc_id)
+                for text, metadata, doc_id in zip(texts[start:end], metadatas[start:end], ids[start:end])
+            ]
+            self.add_vectors(vectors, documents, ids[start:end])
+        return ids
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        removed = {self._positions[doc_id] for doc_id in ids or [] if doc_id in self._positions}
+        if not removed:
+            return False
+        self.index.remove(removed)
+        self.ids = [doc_id for i, doc_id in enumerate(self.ids) if i not in removed]
+        self.documents = [doc for i, doc in enumerate(self.documents) if i not in removed]
+        self._positions = {doc_id: i for i, doc_id in enumerate(self.ids)}
+        return True
+
+    def get_by_ids(self, ids) -> List[Document]:
+        return [self.documents[self._positions[doc_id]] for doc_id in ids if doc_id in self._positions]
+
+    def similarity_search_by_vector_batch(self, vectors, k: int = 4) -> List[List[Tuple[Document, float]]]:
+        if self.index is None:
+            return [[] for _ in vectors]
+        scores, positions = self.index.search(vectors, k)
+        # ANN backends pad rows with -1 when fewer than k candidates were found
+        return [
+            [(self.documents[p], float(s)) for p, s in zip(row_positions, row_scores) if p >= 0]
+            for row_positions, row_scores in zip(positions, scores)
+        ]
+
+    def similarity_search_batch(self, queries: List[str], k: int = 4) -> List[List[Tuple[Document, float]]]:
+        # One embedding call and one matrix multiply for the whole batch of queries
+        return self.similarity_search_by_vector_batch(self.embedding.embed_documents(queries), k)
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_batch([self.embedding.embed_query(query)], k)[0]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_batch([embedding], k)[0]]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def _select_relevance_score_fn(self):
+        # Scores are already cosine similarities
+        return lambda score: score
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None,
+                   ids: Optional[List[str]] = None, **kwargs: Any) -> 'NumpyVectorStore':
+        store = cls(embedding, **kwargs)
+        store.add_texts(texts, metadatas, ids)
+        return store
+
+    def save_local(self, folder: str):
+        os.makedirs(folder, exist_ok=True)
+        # The index is created with the first vectors; an empty store saves none
+        if self.index is not None:
+            self.index.save(folder)
+        with open(os.path.join(folder, 'store.json'), 'w') as f:
+            json.dump({'index_backend': self.index_backend, 'dtype': self.dtype, 'empty': self.index is None}, f)
+        with open(os.path.join(folder, 'documents.jsonl'), 'w') as f:
+            for doc_id, doc in zip(self.ids, self.documents):
+                f.write(json.dumps({'id': doc_id, 'page_content': doc.page_content, 'metadata': doc.metadata}) + '\n')
+
+    @classmethod
+    def load_local(cls, folder: str, embedding: Embeddings, mmap: bool = True) -> 'NumpyVectorStore':
+        with open(os.path.join(folder, 'store.json')) as f:
+            settings = json.load(f)
+        empty = settings.pop('empty', False)
+        store = cls(embedding, **settings)
+        if not empty:
+            store.index = INDEX_CLASSES[settings['index_backend']].load(folder, mmap=mmap)
+        with open(os.path.join(folder, 'documents.jsonl')) as f:
+            for position, line in enumerate(f):
+                record = json.loads(line)
+                store.ids.append(record['id'])
+                store.documents.append(Document(page_content=record['page_content'], metadata=record['metadata'], id=record['id']))
+                store._positions[record['id']] = position
+        return store
+
+def benchmark_search(rows: int = 100000, dimension: int = 384, queries: int = 256, k: int = 10):
+    # Batched matrix search vs. a per-query loop and a pure-Python loop
+    rng = np.random.default_rng(0)
+    data = rng.standard_normal((rows, dimension), dtype=np.float32)
+    query_vectors = rng.standard_normal((queries, dimension), dtype=np.float32)
+    for dtype in SUPPORTED_DTYPES:
+        index = VectorIndex(dimension, dtype)
+        index.add(data)
+        start = time.perf_counter()
+        index.search(query_vectors, k)
+        batched = time.perf_counter() - start
+        print(f'{dtype:>8}: batched {batched / queries * 1000:.3f}ms/query, '
+              f'{index.matrix.nbytes / 2 ** 20:.0f}MB')
+    index = VectorIndex(dimension)
+    index.add(data)
+    start = time.perf_counter()
+    for query in query_vectors[:16]:
+        index.search(query, k)
+    print(f'per-query numpy: {(time.perf_counter() - start) / 16 * 1000:.3f}ms/query')
+    # Pure Python over a 1% sample, scaled up to the full index
+    sample = index.matrix[:rows // 100].tolist()
+    query = normalize(query_vectors[0]).tolist()
+    start = time.perf_counter()
+    scores = [sum(a * b for a, b in zip(query, row)) for row in sample]
+    sorted(range(len(scores)), key=scores.__getitem__)[-k:]
+    print(f'pure Python loop: ~{(time.perf_counter() - start) * 100 * 1000:.0f}ms/query')
+
+def clustered_vectors(rows: int, dimension: int, clusters: int = 1000, seed: int = 0) -> np.ndarray:
+    # Mixture of Gaussians: closer to real embedding distributions than uniform noise
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dimension), dtype=np.float32)
+    labels = rng.integers(0, clusters, rows)
+    return centers[labels] + 0.5 * rng.standard_normal((rows, dimension), dtype=np.float32)
+
+def benchmark_ann(rows: int = 100000, dimension: int = 128, queries: int = 200, k: int = 10):
+    # recall@k and single-query latency of each ANN setting against exact search
+    data = clustered_vectors(rows, dimension)
+    query_vectors = clustered_vectors(queries, dimension, seed=1)
+    exact = VectorIndex(dimension)
+    exact.add(data)
+    _, truth = exact.search(query_vectors, k)
+    def measure(name, index):
+        latencies = []
+        found = []
+        for query in query_vectors:
+            start = time.perf_counter()
+            _, positions = index.search(query, k)
+            latencies.append(time.perf_counter() - start)
+            found.append(positions[0])
+        recall = np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])
+        latencies.sort()
+        print(f'{name:>22}: recall@{k} {recall:.3f}, p50 {latencies[len(latencies) // 2] * 1000:.2f}ms, '
+              f'p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:.2f}ms')
+    measure('exact', exact)
+    ivf = IVFIndex(dimension)
+    ivf.add(data)
+    for nprobe in (1, 4, 16, 64):
+        ivf.nprobe = nprobe
+        measure(f'numpy ivf nprobe={nprobe}', ivf)
+    if faiss is not None:
+        hnsw = FaissIndex(dimension, kind='hnsw')
+        hnsw.add(data)
+        for ef_search in (16, 64, 256):
+            hnsw.ef_search = ef_search
+            measure(f'faiss hnsw ef={ef_search}', hnsw)
+        faiss_ivf = FaissIndex(dimension, kind='ivf')
+        faiss_ivf.add(data)
+        for nprobe in (1, 8, 32):
+            faiss_ivf.nprobe = nprobe
+            measure(f'faiss ivf nprobe={nprobe}', faiss_ivf)
+
+if __name__ == '__main__' and sys.argv[1:2] == ['ann']:
+    benchmark_ann(*(int(arg) for arg in sys.argv[2:3]))
+elif __name__ == '__main__':
+    from response_cache import HashingEmbeddings
+    texts = [
+        'LangChain composes prompts, models and parsers into chains.',
+        'FAISS and Chroma are vector databases for similarity search.',
+        'Embeddings map text to vectors so similar meanings are close together.',
+        'Rate limiting protects APIs from too many requests.',
+    ]
+    store = NumpyVectorStore.from_texts(texts, HashingEmbeddings())
+    retriever = store.as_retriever(search_kwargs={'k': 2})
+    for doc in retriever.invoke('which vector databases support similarity search?'):
+        print(doc.page_content)
+    benchmark_search()
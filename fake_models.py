@@ -0,0 +1,101 @@
+import asyncio
+import random
+import time
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from response_cache import HashingEmbeddings
+
+class FakeChatModel(BaseChatModel):
+    # Local stand-in for a provider with configurable latency and failure rate.
+    # Async calls sleep with asyncio so thousands of concurrent requests stay cheap.
+    response: str = 'Fake response'
+    delay: float = 0.05
+    # Occasional stragglers: with probability tail_rate the call takes tail_delay instead
+    tail_delay: float = 0.0
+    tail_rate: float = 0.0
+    failure_rate: float = 0.0
+    # Generation time per output token, after the time-to-first-token delay
+    token_delay: float = 0.0
+    calls: int = 0
+    input_tokens: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return 'fake-chat'
+
+    def get_num_tokens(self, text: str) -> int:
+        # ~4 characters per token, so no tokenizer download is needed offline
+        return len(text) // 4 + 1
+
+    def _sample_delay(self) -> float:
+        if self.tail_rate and random.random() < self.tail_rate:
+            return self.tail_delay
+        return self.delay
+
+    def _respond(self, messages) -> str:
+        self.calls += 1
+        self.input_tokens += sum(self.get_num_tokens(str(message.content)) for message in messages)
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise RuntimeError(f'{self.response}: simulated provider failure')
+        return self.response
+
+    def _result(self, text: str) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    def _generation_time(self, text: str) -> float:
+        return self.token_delay * len(text.split(' '))
+
+    def _truncate(self, text: str, max_tokens: int = None) -> str:
+        # A max_tokens bound at call time cuts the reply off, ~4 characters per token
+        return text if max_tokens is None else text[:4 * max_tokens]
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self._sample_delay())
+        text = self._truncate(self._respond(messages), kwargs.get('max_tokens'))
+        time.sleep(self._generation_time(text))
+        return self._result(text)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self._sample_delay())
+        text = self._truncate(self._respond(messages), kwargs.get('max_tokens'))
+        await asyncio.sleep(self._generation_time(text))
+        return self._result(text)
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        # The delay is spent before the first token, like a real time-to-first-token
+        time.sleep(self._sample_delay())
+        for i, token in enumerate(self._truncate(self._respond(messages), kwargs.get('max_tokens')).split(' ')):
+            if i and self.token_delay:
+                time.sleep(self.token_delay)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token + ' '))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self._sample_delay())
+        for i, token in enumerate(self._truncate(self._respond(messages), kwargs.get('max_tokens')).split(' ')):
+            if i and self.token_delay:
+                await asyncio.sleep(self.token_delay)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token + ' '))
+
+class FakeEmbeddings(HashingEmbeddings):
+    # Local embeddings that charge a fixed round-trip delay per call, like a remote API,
+    # and count calls and embedded texts
+    def __init__(self, dimensions: int = 512, delay: float = 0.0):
+        super().__init__(dimensions)
+        self.delay = delay
+        self.calls = 0
+        self.texts_embedded = 0
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        self.texts_embedded += len(texts)
+        time.sleep(self.delay)
+        return super().embed_documents(texts)
+
+    def embed_query(self, text):
+        self.calls += 1
+        self.texts_embedded += 1
+        time.sleep(self.delay)
+        return super().embed_query(text)
@@ -0,0 +1,195 @@
+import asyncio
+import json
+import socket
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+try:
+    import h2  # noqa: F401 - httpx needs it for HTTP/2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+DEFAULT_BASE_URLS = {
+    'openai': 'https://api.openai.com/v1',
+    'anthropic': 'https://api.anthropic.com',
+}
+
+def _config_key(kwargs: dict):
+    # Model kwargs as JSON; None when a value isn't plain data (a cache object, a
+    # callback), in which case the model is built fresh instead of memoized
+    try:
+        return json.dumps(kwargs, sort_keys=True)
+    except (TypeError, ValueError):
+        return None
+
+class ModelRegistry:
+    # Hands out chat models that share one keep-alive connection pool (a sync and an
+    # async httpx client) per provider endpoint, instead of a client per model
+    # instance. Identical model configurations (plain-data kwargs) return the same instance.
+    # HTTP/2 is used when requested and the h2 package is installed.
+    def __init__(self, max_connections: int = 100, max_keepalive_connections: int = 20,
+                 keepalive_expiry: float = 30.0, http2: bool = True, timeout: float = 60.0):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.http2 = http2 and HTTP2_AVAILABLE
+        self.timeout = timeout
+        self._pools = {}
+        self._models = {}
+        self._lock = threading.Lock()
+        self.stats = {'pools': 0, 'models_created': 0, 'models_reused': 0}
+
+    def pool(self, provider: str, base_url: str = None) -> tuple:
+        # (httpx.Client, httpx.AsyncClient) for an endpoint, created on first use
+        key = (provider, base_url or DEFAULT_BASE_URLS.get(provider))
+        with self._lock:
+            if key not in self._pools:
+                options = {'limits': self.limits, 'http2': self.http2, 'timeout': self.timeout}
+                self._pools[key] = (httpx.Client(**options), httpx.AsyncClient(**options))
+                self.stats['pools'] += 1
+            return self._pools[key]
+
+    def _create(self, provider: str, model: str, base_url: str, kwargs: dict):
+        sync_client, async_client = self.pool(provider, base_url)
+        if provider == 'openai':
+            from langchain_openai import ChatOpenAI
+            if base_url:
+                kwargs['base_url'] = base_url
+            return ChatOpenAI(model=model, http_client=sync_client, http_async_client=async_client, **kwargs)
+        if provider == 'anthropic':
+            import anthropic
+            from langchain_anthropic import ChatAnthropic
+            if base_url:
+                kwargs['base_url'] = base_url
+            chat_model = ChatAnthropic(model=model, **kwargs)
+            # ChatAnthropic has no http_client field; pre-fill its cached SDK clients
+            params = chat_model._client_params
+            chat_model.__dict__['_client'] = anthropic.Client(**params, http_client=sync_client)
+            chat_model.__dict__['_async_client'] = anthropic.AsyncClient(**params, http_client=async_client)
+            return chat_model
+        raise ValueError(f'Unknown provider: {provider}')
+
+    def chat_model(self, provider: str = 'openai', model: str = 'gpt-3.5-turbo', base_url: str = None, **kwargs):
+        config = _config_key(kwargs)
+        key = (provider, model, base_url, config)
+        with self._lock:
+            if config is not None and key in self._models:
+                self.stats['models_reused'] += 1
+                return self._models[key]
+        chat_model = self._create(provider, model, base_url, dict(kwargs))
+        with self._lock:
+            if config is not None:
+                chat_model = self._models.setdefault(key, chat_model)
+            self.stats['models_created'] += 1
+        return chat_model
+
+    def close(self):
+        for sync_client, _ in self._pools.values():
+            sync_client.close()
+
+    async def aclose(self):
+        for _, async_client in self._pools.values():
+            await async_client.aclose()
+
+default_registry = ModelRegistry()
+
+def get_chat_model(provider: str = 'openai', model: str = 'gpt-3.5-turbo', **kwargs):
+    # Project-wide entry point: models from here share connection pools
+    return default_registry.chat_model(provider, model, **kwargs)
+
+class _StubHandler(BaseHTTPRequestHandler):
+    # Minimal OpenAI/Anthropic-compatible endpoint with keep-alive
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        # Stand-in for TCP + TLS setup cost on every new connection
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.server.lock:
+            self.server.connections += 1
+        time.sleep(self.server.handshake_delay)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(self.server.response_delay)
+        if self.path.endswith('/messages'):
+            body = {'id': 'msg_stub', 'type': 'message', 'role': 'assistant', 'model': 'stub',
+                    'content': [{'type': 'text', 'text': 'stub reply'}], 'stop_reason': 'end_turn',
+                    'usage': {'input_tokens': 5, 'output_tokens': 2}}
+        else:
+            body = {'id': 'chatcmpl-stub', 'object': 'chat.completion', 'created': 0, 'model': 'stub',
+                    'choices': [{'index': 0, 'finish_reason': 'stop',
+                                 'message': {'role': 'assistant', 'content': 'stub reply'}}],
+                    'usage': {'prompt_tokens': 5, 'completion_tokens': 2, 'total_tokens': 7}}
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+class _StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+def start_stub_server(handshake_delay: float = 0.03, response_delay: float = 0.005) -> ThreadingHTTPServer:
+    server = _StubServer(('127.0.0.1', 0), _StubHandler)
+    server.lock = threading.Lock()
+    server.connections = 0
+    server.handshake_delay = handshake_delay
+    server.response_delay = response_delay
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def _latencies(make_model, requests: int) -> list:
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        make_model().invoke('ping')
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+def verify_against_stub(requests: int = 100, concurrent: int = 20):
+    # Sequential p50/p95 and TCP connections opened: a private client per model
+    # instance vs. registry models, then two concurrent async waves on the registry;
+    # the second wave should reuse the first wave's connections
+    from langchain_openai import ChatOpenAI
+    server = start_stub_server()
+    base_url = f'http://127.0.0.1:{server.server_address[1]}/v1'
+    registry = ModelRegistry(max_keepalive_connections=20)
+    cases = {
+        'own client per instance': lambda: ChatOpenAI(api_key='stub', base_url=base_url, max_retries=0,
+                                                      http_client=httpx.Client()),
+        'registry': lambda: registry.chat_model('openai', base_url=base_url, api_key='stub', max_retries=0),
+        'registry (anthropic)': lambda: registry.chat_model('anthropic', 'claude-3-haiku-20240307',
+                                                            base_url=base_url[:-3], api_key='stub', max_retries=0),
+    }
+    for name, make_model in cases.items():
+        opened = server.connections
+        latencies = sorted(_latencies(make_model, requests))
+        print(f'{name:>24}: p50 {statistics.median(latencies) * 1000:.1f} ms, '
+              f'p95 {latencies[int(len(latencies) * 0.95)] * 1000:.1f} ms, '
+              f'{server.connections - opened} connections for {requests} requests')
+
+    async def waves():
+        chat_model = registry.chat_model('openai', base_url=base_url, api_key='stub', max_retries=0)
+        for wave in (1, 2):
+            opened = server.connections
+            await asyncio.gather(*(chat_model.ainvoke('ping') for _ in range(concurrent)))
+            print(f'async wave {wave}: {concurrent} concurrent requests, {server.connections - opened} new connections')
+    asyncio.run(waves())
+    print(f'http2={registry.http2}, registry stats {registry.stats}')
+    server.shutdown()
+
+if __name__ == '__main__':
+    verify_against_stub()
@@ -0,0 +1,309 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+import warnings
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.caches import BaseCache
+from langchain_core.embeddings import Embeddings
+from langchain_core.globals import get_llm_cache, set_llm_cache
+from langchain_core.load import dumps, loads
+from langchain_core.messages import message_chunk_to_message
+from langchain_core.outputs import ChatGeneration
+
+class HashingEmbeddings(Embeddings):
+    # Deterministic local embedding: hashed word unigrams and bigrams, L2-normalized.
+    # Near-identical prompts land close together without any network call.
+    def __init__(self, dimensions: int = 512):
+        self.dimensions = dimensions
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        words = re.findall(r'\w+', text.lower())
+        features = words + [f'{a} {b}' for a, b in zip(words, words[1:])]
+        for feature in features:
+            digest = hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest()
+            index = int.from_bytes(digest[:4], 'little') % self.dimensions
+            sign = 1.0 if digest[4] & 1 else -1.0
+            vector[index] += sign
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector /= norm
+        return vector.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+def _collapse_content(content):
+    if isinstance(content, str):
+        return ' '.join(content.split())
+    if isinstance(content, list):
+        return [
+            {**block, 'text': ' '.join(block['text'].split())}
+            if isinstance(block, dict) and isinstance(block.get('text'), str) else _collapse_content(block)
+            for block in content
+        ]
+    return content
+
+def _messages(prompt: str):
+    # Chat models hand the cache a serialized message list; other models a plain string
+    try:
+        messages = json.loads(prompt)
+    except ValueError:
+        return None
+    return messages if isinstance(messages, list) else None
+
+def normalize_prompt(prompt: str) -> str:
+    # Cache key text: the full serialized payload (roles, tool calls, additional kwargs)
+    # with whitespace runs in message content collapsed, so formatting noise doesn't
+    # miss. Case and everything outside content are kept as-is
+    messages = _messages(prompt)
+    if messages is None:
+        return ' '.join(prompt.split())
+    normalized = []
+    for message in messages:
+        if isinstance(message, dict) and isinstance(message.get('kwargs'), dict) and 'content' in message['kwargs']:
+            message = {**message, 'kwargs': {**message['kwargs'], 'content': _collapse_content(message['kwargs']['content'])}}
+        normalized.append(message)
+    return json.dumps(normalized, sort_keys=True, separators=(',', ':'))
+
+def prompt_text(prompt: str) -> str:
+    # Readable "role: content" lines for the semantic tier's embedding
+    messages = _messages(prompt)
+    if messages is None:
+        return ' '.join(prompt.split())
+    lines = []
+    for message in messages:
+        kwargs = message.get('kwargs', {}) if isinstance(message, dict) else {}
+        role = kwargs.get('type') or message.get('id', ['message'])[-1]
+        lines.append(f"{role}: {' '.join(str(kwargs.get('content', '')).split())}")
+    return '\n'.join(lines)
+
+class SemanticResponseCache(BaseCache):
+    # LLM cache persisted in SQLite:
+    # 1. exact match on (full message payload with whitespace collapsed, model name and parameters)
+    # 2. opt-in semantic match (semantic=True plus a real embedding model) when a prompt's
+    #    embedding is within similarity_threshold of a stored prompt for the same model
+    #    configuration. Keep the threshold strict: prompts that differ by one word
+    #    ("happy" / "unhappy") can still score above 0.99
+    # Entries are evicted least-recently-used beyond max_entries, and expire after ttl seconds.
+    def __init__(self, database_path: str = '.llm_cache.sqlite', embeddings: Embeddings = None,
+                 similarity_threshold: float = 0.995, max_entries: int = 10000,
+                 ttl: Optional[float] = None, semantic: bool = False):
+        if semantic and embeddings is None:
+            raise ValueError('Semantic matching needs an embedding model')
+        self.embeddings = embeddings
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.semantic = semantic
+        self.stats = {'exact_hits': 0, 'semantic_hits': 0, 'misses': 0, 'evictions': 0}
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(database_path, check_same_thread=False)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS llm_cache ('
+            'key TEXT PRIMARY KEY, llm_string TEXT, return_val TEXT, '
+            'embedding BLOB, created_at REAL, last_used REAL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS llm_cache_last_used ON llm_cache (last_used)')
+        self._conn.commit()
+        # In-memory vector index per model configuration: llm_string -> (keys, matrix).
+        # The matrix is preallocated and grows geometrically; only its first len(keys) rows are used
+        self._vectors = {}
+        if self.semantic:
+            self._load_vectors()
+
+    def _load_vectors(self):
+        rows = self._conn.execute('SELECT key, llm_string, embedding FROM llm_cache').fetchall()
+        grouped = {}
+        for key, llm_string, blob in rows:
+            if not blob:
+                # Stored while semantic matching was off
+                continue
+            grouped.setdefault(llm_string, []).append((key, np.frombuffer(blob, dtype=np.float32)))
+        for llm_string, entries in grouped.items():
+            keys = [key for key, _ in entries]
+            self._vectors[llm_string] = (keys, np.vstack([vector for _, vector in entries]))
+
+    @staticmethod
+    def _key(normalized: str, llm_string: str) -> str:
+        return hashlib.sha256(f'{llm_string}\x00{normalized}'.encode('utf-8')).hexdigest()
+
+    def _embed(self, text: str) -> np.ndarray:
+        vector = np.asarray(self.embeddings.embed_query(text), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _fetch(self, key: str):
+        row = self._conn.execute(
+            'SELECT return_val, created_at FROM llm_cache WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        return_val, created_at = row
+        if self.ttl is not None and time.time() - created_at > self.ttl:
+            self._delete([key])
+            return None
+        self._conn.execute('UPDATE llm_cache SET last_used = ? WHERE key = ?', (time.time(), key))
+        self._conn.commit()
+        with warnings.catch_warnings():
+            # langchain_core.load.loads is marked beta but is the supported round-trip for dumps
+            warnings.simplefilter('ignore')
+            return [loads(generation) for generation in json.loads(return_val)]
+
+    def _delete(self, keys: list):
+        self._conn.executemany('DELETE FROM llm_cache WHERE key = ?', [(key,) for key in keys])
+        self._conn.commit()
+        removed = set(keys)
+        for llm_string, (stored_keys, matrix) in list(self._vectors.items()):
+            keep = [i for i, key in enumerate(stored_keys) if key not in removed]
+            if len(keep) == len(stored_keys):
+                continue
+            if keep:
+                self._vectors[llm_string] = ([stored_keys[i] for i in keep], matrix[keep])
+            else:
+                del self._vectors[llm_string]
+
+    def lookup(self, prompt: str, llm_string: str):
+        normalized = normalize_prompt(prompt)
+        key = self._key(normalized, llm_string)
+        with self._lock:
+            cached = self._fetch(key)
+            if cached is not None:
+                self.stats['exact_hits'] += 1
+                return cached
+            if self.semantic and llm_string in self._vectors:
+                keys, matrix = self._vectors[llm_string]
+                scores = matrix[:len(keys)] @ self._embed(prompt_text(prompt))
+                best = int(np.argmax(scores))
+                if scores[best] >= self.similarity_threshold:
+                    cached = self._fetch(keys[best])
+                    if cached is not None:
+                        self.stats['semantic_hits'] += 1
+                        return cached
+            self.stats['misses'] += 1
+            return None
+
+    def update(self, prompt: str, llm_string: str, return_val):
+        normalized = normalize_prompt(prompt)
+        key = self._key(normalized, llm_string)
+        vector = self._embed(prompt_text(prompt)) if self.semantic else np.zeros(0, dtype=np.float32)
+        now = time.time()
+        with self._lock:
+            exists = self._conn.execute('SELECT 1 FROM llm_cache WHERE key = ?', (key,)).fetchone()
+            self._conn.execute(
+                'INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?, ?, ?)',
+                (key, llm_string, json.dumps([dumps(generation) for generation in return_val]),
+                 vector.tobytes(), now, now),
+            )
+            self._conn.commit()
+            if self.semantic and not exists:
+                self._append_vector(llm_string, key, vector)
+            self._evict()
+
+    def _append_vector(self, llm_string: str, key: str, vector: np.ndarray):
+        keys, matrix = self._vectors.get(llm_string, ([], np.empty((0, len(vector)), dtype=np.float32)))
+        if len(keys) == len(matrix):
+            grown = np.empty((max(16, 2 * len(matrix)), len(vector)), dtype=np.float32)
+            grown[:len(keys)] = matrix[:len(keys)]
+            matrix = grown
+        matrix[len(keys)] = vector
+        keys.append(key)
+        self._vectors[llm_string] = (keys, matrix)
+
+    def _evict(self):
+        (count,) = self._conn.execute('SELECT COUNT(*) FROM llm_cache').fetchone()
+        overflow = count - self.max_entries
+        if overflow <= 0:
+            return
+        rows = self._conn.execute(
+            'SELECT key FROM llm_cache ORDER BY last_used LIMIT ?', (overflow,)
+        ).fetchall()
+        self._delete([key for (key,) in rows])
+        self.stats['evictions'] += len(rows)
+
+    def clear(self, **kwargs):
+        with self._lock:
+            self._conn.execute('DELETE FROM llm_cache')
+            self._conn.commit()
+            self._vectors = {}
+
+    def hit_rate(self) -> float:
+        hits = self.stats['exact_hits'] + self.stats['semantic_hits']
+        total = hits + self.stats['misses']
+        return hits / total if total else 0.0
+
+def _stream_cache(llm, messages):
+    # The cache a chat model's invoke would use, plus the (prompt, llm_string) key it
+    # would store under, so streamed and invoked answers share entries
+    cache = llm.cache if isinstance(llm.cache, BaseCache) else (None if llm.cache is False else get_llm_cache())
+    if cache is None:
+        return None, None
+    return cache, (dumps(messages), llm._get_llm_string())
+
+def stream_with_cache(llm, messages):
+    # BaseChatModel.stream neither reads nor writes the LLM cache. Serve a cached answer
+    # as a single chunk, or stream and store the assembled answer once the stream ends
+    cache, key = _stream_cache(llm, messages)
+    if cache is None:
+        yield from llm.stream(messages)
+        return
+    cached = cache.lookup(*key)
+    if cached:
+        yield cached[0].message
+        return
+    message = None
+    for chunk in llm.stream(messages):
+        message = chunk if message is None else message + chunk
+        yield chunk
+    if message is not None:
+        cache.update(*key, [ChatGeneration(message=message_chunk_to_message(message))])
+
+async def astream_with_cache(llm, messages):
+    cache, key = _stream_cache(llm, messages)
+    if cache is None:
+        async for chunk in llm.astream(messages):
+            yield chunk
+        return
+    cached = await cache.alookup(*key)
+    if cached:
+        yield cached[0].message
+        return
+    message = None
+    async for chunk in llm.astream(messages):
+        message = chunk if message is None else message + chunk
+        yield chunk
+    if message is not None:
+        await cache.aupdate(*key, [ChatGeneration(message=message_chunk_to_message(message))])
+
+def enable_response_cache(**kwargs) -> SemanticResponseCache:
+    # Install the cache globally so every chat model call goes through it. Call this from
+    # an entry point, not at import time: it writes database_path in the working directory
+    cache = SemanticResponseCache(**kwargs)
+    set_llm_cache(cache)
+    return cache
+
+if __name__ == '__main__':
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+    # Exact matching after collapsing whitespace; the recased and reworded questions are misses
+    cache = SemanticResponseCache(database_path=':memory:')
+    llm = FakeListChatModel(responses=['Machine learning is...', 'Machine Learning is...', 'More precisely, machine learning is...', 'Quantum computing is...'], cache=cache)
+    questions = [
+        'What is machine learning?',
+        'What is machine learning?',
+        '  What is   machine learning? ',
+        'What is Machine Learning?',
+        'What is machine learning exactly?',
+        'Explain quantum computing',
+    ]
+    for question in questions:
+        print(f'{question!r} -> {llm.invoke(question).content}')
+    print(cache.stats, f'hit rate {cache.hit_rate():.0%}')